@@ -0,0 +1,43 @@
+"""
+Micro-benchmark of the per-draw cost of util.helper.draw_arg against alias-table sampling (util.helper.draw_alias)
+
+Example usage:
+    > python benchmark_sampling.py
+    > python benchmark_sampling.py --env GridWorld-2D.POMDP --draws 20000
+"""
+import argparse
+import os
+import timeit
+import numpy as np
+from models import CompiledModel
+from parsers import PomdpParser
+from util.helper import draw_arg, draw_alias, alias_table
+
+
+def bench(label, probs, draws):
+    row = list(probs)
+    prob, alias = alias_table(row)
+    t_arg = timeit.timeit(lambda: draw_arg(row), number=draws) / draws
+    t_alias = timeit.timeit(lambda: draw_alias(prob, alias), number=draws) / draws
+    print('{:<28} n = {:<6} draw_arg = {:8.2f} us  draw_alias = {:6.2f} us  speedup = {:6.1f}x'.format(
+        label, len(row), t_arg * 1e6, t_alias * 1e6, t_arg / t_alias))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark categorical sampling')
+    parser.add_argument('--env', type=str, default='GridWorld-2D.POMDP', help='The name of environment\'s config file')
+    parser.add_argument('--draws', type=int, default=10000, help='Number of draws per measurement')
+    args = parser.parse_args()
+
+    for n in (2, 49, 500, 5000):
+        bench('random row', np.random.dirichlet(np.ones(n)), args.draws)
+
+    with PomdpParser(os.path.join('environments', 'pomdp', args.env)) as ctx:
+        model = CompiledModel(ctx.copy_env())
+    bench('{} T[0, 0]'.format(args.env), model.T[0, 0], args.draws)
+    bench('{} Z[0, 0]'.format(args.env), model.Z[0, 0], args.draws)
+
+    # whole simulate_action calls, string edges included
+    si, ai = model.states[0], model.actions[0]
+    t = timeit.timeit(lambda: model.simulate_action(si, ai), number=args.draws) / args.draws
+    print('CompiledModel.simulate_action: {:.2f} us'.format(t * 1e6))
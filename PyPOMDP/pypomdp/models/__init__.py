@@ -1,3 +1,5 @@
-
 from .model import Model
-from .rock_sample_problem import RockSampleModel
\ No newline at end of file
+from .compiled_model import CompiledModel
+from .sparse_model import SparseModel
+from .factored_model import FactoredModel
+from .rock_sample_problem import RockSampleModel
@@ -0,0 +1,129 @@
+from models.model import Model
+from util import alias_tables, draw_alias, cdf_tables, draw_cdf
+import numpy as np
+
+
+class CompiledModel(Model):
+    def __init__(self, env):
+        """
+        Same expected attributes as Model, but T, Z and R are compiled once into dense arrays indexed by integer ids:
+            T: (A, S, S) transition probabilities T[a, si, sj]
+            Z: (A, S, O) observation probabilities Z[a, sj, o]
+            R: (A, S)    immediate reward R[a, si]
+            C: (A,)      action costs
+
+        Every (action, state) row of T and every (action, next-state) row of Z also gets a Walker alias table, so
+        sampling a transition or an observation costs two uniform draws whatever the number of states. Normalised
+        cumulative tables of T and Z serve batched inverse-CDF sampling in simulate_batch.
+
+        States, actions and observations keep their names at the edges: the public Model methods still accept and
+        return names, while the *_id methods work on integer ids only.
+        """
+        Model.__init__(self, env)
+
+        if isinstance(self.T, dict):
+            self.compile()
+        if isinstance(self.R, dict):
+            self.compile_rewards()
+        self.C = np.array(self.costs if self.costs else [0.0] * len(self.actions), dtype=float)
+        self.build_samplers()
+
+    def compile(self):
+        """
+        Turns the parsed T and Z dicts into dense arrays
+        """
+        S, A, O = self.states, self.actions, self.observations
+
+        T, Z = self.T, self.Z
+        self.T = np.array([[[T.get((a, si, sj), 0.0) for sj in S] for si in S] for a in A], dtype=float)
+        self.Z = np.array([[[Z.get((a, sj, o), 0.0) for o in O] for sj in S] for a in A], dtype=float)
+
+    def compile_rewards(self):
+        """
+        Rewards are keyed the same way reward_function(a, si) looks them up, i.e. (action, start-state, *, *)
+        """
+        R = self.R
+        self.R = np.array([[R.get((a, si, '*', '*'), 0.0) for si in self.states] for a in self.actions], dtype=float)
+
+    def build_samplers(self):
+        self.T_prob, self.T_alias = alias_tables(self.T)
+        self.Z_prob, self.Z_alias = alias_tables(self.Z)
+        self.T_cdf, self.Z_cdf = cdf_tables(self.T), cdf_tables(self.Z)
+
+    def observation_function(self, action, state, obs):
+        return self.Z[self.action_ids[action], self.state_ids[state], self.observation_ids[obs]]
+
+    def transition_function(self, action, si, sj):
+        return self.T[self.action_ids[action], self.state_ids[si], self.state_ids[sj]]
+
+    def reward_function(self, action='*', si='*', sj='*', obs='*'):
+        # compiled rewards only depend on the action and the start state
+        return self.R[self.action_ids[action], self.state_ids[si]]
+
+    def cost_function(self, action):
+        return self.C[self.action_ids[action]]
+
+    def transition_probs(self, ai, si):
+        return self.T[ai, si]
+
+    def observation_probs(self, ai, sj):
+        return self.Z[ai, sj]
+
+    def simulate_action_id(self, si, ai):
+        """
+        Integer version of simulate_action
+
+        si: current state id
+        ai: action id
+        return: next state id, observation id, reward and cost
+        """
+        sj = draw_alias(self.T_prob[ai, si], self.T_alias[ai, si])
+        oj = draw_alias(self.Z_prob[ai, sj], self.Z_alias[ai, sj])
+        return sj, oj, self.R[ai, si], self.C[ai]
+
+    def simulate_batch(self, states, actions):
+        states = np.asarray(states, dtype=int)
+        actions = np.broadcast_to(np.asarray(actions, dtype=int), states.shape)
+
+        next_states = draw_cdf(self.T_cdf[actions, states])
+        observations = draw_cdf(self.Z_cdf[actions, next_states])
+        return next_states, observations, self.R[actions, states], self.C[actions]
+
+    def observation_weights(self, ai, next_states, oi):
+        return self.Z[ai, np.asarray(next_states, dtype=int), oi]
+
+    def next_belief(self, belief, ai, oi):
+        b_new = self.Z[ai, :, oi] * np.dot(belief, self.T[ai])
+        return b_new / b_new.sum()
+
+    def next_beliefs(self, beliefs, actions, observations):
+        beliefs, actions = np.atleast_2d(beliefs), np.asarray(actions, dtype=int)
+        observations = np.asarray(observations, dtype=int)
+        b_new = np.empty_like(beliefs, dtype=float)
+        for ai in np.unique(actions):
+            rows = np.flatnonzero(actions == ai)
+            b_new[rows] = self.Z[ai][:, observations[rows]].T * np.dot(beliefs[rows], self.T[ai])
+        return b_new / b_new.sum(axis=1, keepdims=True)
+
+    def expected_values(self, values):
+        return np.dot(self.T, values)
+
+    def project(self, ai, oi, alphas):
+        return self.discount * np.dot(alphas, (self.T[ai] * self.Z[ai, :, oi]).T)
+
+    def projection_matrices(self):
+        A, S, O = self.Z.shape
+        if A * O * S * S > self.MAX_PROJECTION_ENTRIES:
+            return None
+        return self.discount * self.T[:, None, :, :] * self.Z.transpose(0, 2, 1)[:, :, None, :]
+
+    def simulate_action(self, si, ai, debug=False):
+        s, a = self.state_ids[si], self.action_ids[ai]
+        sj, oj, reward, cost = self.simulate_action_id(s, a)
+
+        if debug:
+            print('taking action {} at state {}'.format(ai, si))
+            print('transition probs: {}'.format(self.transition_probs(a, s)))
+            print('obs probs: {}'.format(self.observation_probs(a, sj)))
+
+        return self.states[sj], self.observations[oj], float(reward), float(cost)
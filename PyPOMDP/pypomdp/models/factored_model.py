@@ -0,0 +1,258 @@
+from models.model import Model
+from util import cdf_tables, draw_cdf
+from util.sparse import CSRMatrix
+import numpy as np
+import itertools
+import random
+
+
+class FactorTable(object):
+    """
+    A conditional probability table (or reward function) of a factored model. Each parent is read from a
+    (kind, k) source: ('a', 0) the action, ('prev', k) / ('curr', k) state variable k before / after the
+    transition and ('obs', k) observation variable k
+    """
+    def __init__(self, cpt, sources):
+        self.var = cpt['var']
+        self.table = cpt['table']
+        self.sources = [sources[p] for p in cpt['parents']]
+        self.cdf = None
+
+    def index(self, values):
+        return tuple(values[kind][k] for kind, k in self.sources)
+
+    def sample(self, values):
+        if self.cdf is None:
+            self.cdf = cdf_tables(self.table)
+        cdf = self.cdf[self.index(values)]
+        return min(int(np.searchsorted(cdf, random.random(), side='right')), len(cdf) - 1)
+
+    def sample_batch(self, values, n):
+        if self.cdf is None:
+            self.cdf = cdf_tables(self.table)
+        cdf = self.cdf[self.index(values)]
+        # parentless tables give a single row for the whole batch
+        return draw_cdf(np.broadcast_to(cdf, (n, cdf.shape[-1])))
+
+
+class FactoredModel(Model):
+    def __init__(self, env):
+        """
+        Expected attributes in env (see PomdpxParser):
+            model_name, model_spec, discount, values, costs
+            state_vars: [{prev, curr, values}]
+            obs_vars: [{name, values}]
+            action_var: {name, values}
+            initial_belief, transition, observation: conditional probability tables {var, parents, table}
+            reward: reward functions {var, parents, table}
+
+        A joint state (or observation) is the tuple of its variable values: its id is the C-order mixed-radix index
+        of the tuple and its name the space-separated value names. Transitions and observations are sampled variable
+        by variable from the tables, so no joint T, Z or R is ever built.
+        """
+        env = dict(env)
+        env['states'] = [' '.join(v) for v in itertools.product(*[var['values'] for var in env['state_vars']])]
+        env['observations'] = [' '.join(v) for v in itertools.product(*[var['values'] for var in env['obs_vars']])]
+        env['actions'] = list(env['action_var']['values'])
+        Model.__init__(self, env)
+
+        self.state_sizes = [len(var['values']) for var in self.state_vars]
+        self.obs_sizes = [len(var['values']) for var in self.obs_vars]
+        self.C = np.array(self.costs if self.costs else [0.0] * len(self.actions), dtype=float)
+
+        sources = {self.action_var['name']: ('a', 0)}
+        for k, var in enumerate(self.state_vars):
+            sources[var['prev']], sources[var['curr']] = ('prev', k), ('curr', k)
+        for k, var in enumerate(self.obs_vars):
+            sources[var['name']] = ('obs', k)
+
+        self.initial_order = self.__order(self.initial_belief, sources, 'prev')
+        self.transition_order = self.__order(self.transition, sources, 'curr')
+        self.observation_order = self.__order(self.observation, sources, 'obs')
+        self.rewards = [FactorTable(f, sources) for f in self.reward]
+        self.static_vars = sorted(set(range(len(self.state_vars))) - set(k for k, _ in self.transition_order))
+        self.transitions = None    # joint T as an (A * S, S) CSRMatrix, built on first use (see transition_matrix)
+
+        if self.init_state is None:
+            self.curr_state = self.gen_particles(1)[0]
+
+    @staticmethod
+    def __order(cpts, sources, kind):
+        """
+        Sorts the tables of one kind of variable so that every table comes after the tables of the same-kind
+        variables it depends on
+        :return: [(variable index, FactorTable)]
+        """
+        pending = [FactorTable(cpt, sources) for cpt in cpts]
+        order, done = [], set()
+        while pending:
+            ready = [t for t in pending if all(k in done for src, k in t.sources if src == kind)]
+            if not ready:
+                raise ValueError('Cyclic dependencies between {} variables'.format(kind))
+            for t in ready:
+                k = sources[t.var][1]
+                order.append((k, t))
+                done.add(k)
+                pending.remove(t)
+        return order
+
+    @staticmethod
+    def __decode(i, sizes):
+        values = [0] * len(sizes)
+        for k in range(len(sizes) - 1, -1, -1):
+            i, values[k] = divmod(i, sizes[k])
+        return values
+
+    @staticmethod
+    def __encode(values, sizes):
+        i = 0
+        for v, n in zip(values, sizes):
+            i = i * n + v
+        return i
+
+    def gen_particles(self, n, prob=None):
+        """
+        Without 'prob', particles are drawn from the initial belief of the file (variables without one are uniform)
+        """
+        if prob is not None:
+            prob = np.asarray(prob, dtype=float)
+            ids = np.random.choice(len(prob), size=n, p=prob / prob.sum())
+        else:
+            values = {'prev': [np.random.randint(0, size, n) for size in self.state_sizes]}
+            for k, cpt in self.initial_order:
+                values['prev'][k] = cpt.sample_batch(values, n)
+            ids = np.ravel_multi_index(values['prev'], self.state_sizes)
+        return [self.states[i] for i in ids]
+
+    def __values(self, ai, si=None, sj=None):
+        return {
+            'a': [ai],
+            'prev': None if si is None else self.__decode(si, self.state_sizes),
+            'curr': None if sj is None else self.__decode(sj, self.state_sizes),
+        }
+
+    def transition_function(self, action, si, sj):
+        sj = self.state_ids[sj]
+        values = self.__values(self.action_ids[action], self.state_ids[si], sj)
+        # variables without a table keep their value
+        prob = float(all(values['prev'][k] == values['curr'][k] for k in self.static_vars))
+        for k, cpt in self.transition_order:
+            prob *= cpt.table[cpt.index(values) + (values['curr'][k],)]
+        return prob
+
+    def observation_function(self, action, state, obs):
+        values = self.__values(self.action_ids[action], sj=self.state_ids[state])
+        obs = self.__decode(self.observation_ids[obs], self.obs_sizes)
+        prob = 1.0
+        for k, cpt in self.observation_order:
+            prob *= cpt.table[cpt.index(values) + (obs[k],)]
+        return prob
+
+    def reward_function(self, action='*', si='*', sj='*', obs='*'):
+        # rewards are read from the (action, start-state) parents, like the flat models do
+        values = self.__values(self.action_ids[action], self.state_ids[si])
+        return sum(f.table[f.index(values)] for f in self.rewards)
+
+    def cost_function(self, action):
+        return self.C[self.action_ids[action]]
+
+    def simulate_action_id(self, si, ai):
+        values = self.__values(ai, si)
+        values['curr'] = list(values['prev'])
+        values['obs'] = [0] * len(self.obs_sizes)
+        for k, cpt in self.transition_order:
+            values['curr'][k] = cpt.sample(values)
+        for k, cpt in self.observation_order:
+            values['obs'][k] = cpt.sample(values)
+
+        sj = self.__encode(values['curr'], self.state_sizes)
+        oj = self.__encode(values['obs'], self.obs_sizes)
+        reward = sum(f.table[f.index(values)] for f in self.rewards)
+        return sj, oj, reward, self.C[ai]
+
+    def simulate_action(self, si, ai, debug=False):
+        sj, oj, reward, cost = self.simulate_action_id(self.state_ids[si], self.action_ids[ai])
+        if debug:
+            print('taking action {} at state {}'.format(ai, si))
+        return self.states[sj], self.observations[oj], float(reward), float(cost)
+
+    def simulate_batch(self, states, actions):
+        states = np.asarray(states, dtype=int)
+        actions = np.broadcast_to(np.asarray(actions, dtype=int), states.shape)
+
+        values = {'a': [actions], 'prev': list(np.unravel_index(states, self.state_sizes))}
+        values['curr'] = list(values['prev'])
+        values['obs'] = [np.zeros(len(states), dtype=int) for _ in self.obs_sizes]
+        for k, cpt in self.transition_order:
+            values['curr'][k] = cpt.sample_batch(values, len(states))
+        for k, cpt in self.observation_order:
+            values['obs'][k] = cpt.sample_batch(values, len(states))
+
+        next_states = np.ravel_multi_index(values['curr'], self.state_sizes)
+        observations = np.ravel_multi_index(values['obs'], self.obs_sizes)
+        rewards = np.zeros(len(states))
+        for f in self.rewards:
+            rewards += f.table[f.index(values)]
+        return next_states, observations, rewards, self.C[actions]
+
+    def observation_weights(self, ai, next_states, oi):
+        values = {'a': [ai], 'curr': list(np.unravel_index(np.asarray(next_states, dtype=int), self.state_sizes))}
+        values['obs'] = self.__decode(oi, self.obs_sizes)
+        weights = np.ones(len(values['curr'][0]))
+        for k, cpt in self.observation_order:
+            weights *= cpt.table[cpt.index(values) + (values['obs'][k],)]
+        return weights
+
+    def transition_matrix(self):
+        """
+        Joint transition probabilities, row (a, s) at a * |S| + s, built once by expanding every start state over the
+        nonzero entries of the tables, one variable at a time. Only the reachable successors are ever enumerated
+        :return: CSRMatrix
+        """
+        if self.transitions is not None:
+            return self.transitions
+
+        n = self.num_states
+        rows, cols, vals = [], [], []
+        for ai in range(len(self.actions)):
+            starts = np.arange(n)
+            values = {'prev': list(np.unravel_index(starts, self.state_sizes))}
+            values['curr'] = list(values['prev'])
+            probs = np.ones(n)
+            for k, cpt in self.transition_order:
+                values['a'] = [np.full(len(starts), ai)]
+                table = cpt.table[cpt.index(values)]
+                table = np.broadcast_to(table, (len(starts), table.shape[-1]))
+                entry, v = np.nonzero(table)
+                starts, probs = starts[entry], probs[entry] * table[entry, v]
+                values = {kind: [x[entry] for x in values[kind]] for kind in ('prev', 'curr')}
+                values['curr'][k] = v
+            rows.append(ai * n + starts)
+            cols.append(np.ravel_multi_index(values['curr'], self.state_sizes))
+            vals.append(probs)
+
+        self.transitions = CSRMatrix.from_coo(np.concatenate(rows), np.concatenate(cols), np.concatenate(vals),
+                                              (len(self.actions) * n, n))
+        return self.transitions
+
+    def expected_values(self, values):
+        T = self.transition_matrix()
+        weights = T.data * np.asarray(values, dtype=float)[T.indices]
+        return T.row_sums(weights, 0, T.shape[0]).reshape(-1, self.num_states)
+
+    def project(self, ai, oi, alphas):
+        T, n = self.transition_matrix(), self.num_states
+        start, end = T.indptr[ai * n], T.indptr[(ai + 1) * n]
+        cols, probs = T.indices[start:end], T.data[start:end]
+        weights = np.asarray(alphas)[:, cols] * (probs * self.observation_weights(ai, cols, oi))
+        return self.discount * T.row_sums(weights, ai * n, n)
+
+    def projection_matrices(self):
+        # the joint (A, O, S, S) tensor is exactly what the factored model avoids building
+        return None
+
+    def print_config(self):
+        print("discount:", self.discount)
+        print("state variables:", [(var['curr'], var['values']) for var in self.state_vars])
+        print("actions:", self.actions)
+        print("observation variables:", [(var['name'], var['values']) for var in self.obs_vars])
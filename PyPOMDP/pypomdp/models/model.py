@@ -5,6 +5,9 @@ import numpy as np
 
 
 class Model(object):
+    # largest dense (A, O, S, S) projection tensor built by projection_matrices, 256 MB of floats
+    MAX_PROJECTION_ENTRIES = 2 ** 25
+
     def __init__(self, env):
         """
         Expected attributes in env:
@@ -23,7 +26,12 @@ class Model(object):
         for k, v in env.items():
             self.__dict__[k] = v
 
+        self.state_ids = {s: i for i, s in enumerate(self.states)}
+        self.action_ids = {a: i for i, a in enumerate(self.actions)}
+        self.observation_ids = {o: i for i, o in enumerate(self.observations)}
+
         self.curr_state = self.init_state or np.random.choice(self.states)
+        self.__transitions = None    # dense (A, S, S) T, built on the first expected_values call
 
     @property
     def num_states(self):
@@ -31,7 +39,7 @@ class Model(object):
 
     @property
     def num_actions(self):
-        return len(self.states)
+        return len(self.actions)
 
     def gen_particles(self, n, prob=None):
         if prob is None:
@@ -91,6 +99,111 @@ class Model(object):
 
         return state, observation, reward, cost
 
+    def simulate_batch(self, states, actions):
+        """
+        Vectorised simulate_action over arrays of particles, using integer ids (positions in self.states,
+        self.actions and self.observations)
+
+        states: state ids
+        actions: action ids, or a single action id shared by every state
+        return: arrays of next state ids, observation ids, rewards and costs
+        """
+        states = np.asarray(states, dtype=int)
+        actions = np.broadcast_to(np.asarray(actions, dtype=int), states.shape)
+
+        results = [self.simulate_action(self.states[si], self.actions[ai]) for si, ai in zip(states, actions)]
+        next_states = np.array([self.state_ids[sj] for sj, _, _, _ in results], dtype=int)
+        observations = np.array([self.observation_ids[oj] for _, oj, _, _ in results], dtype=int)
+        rewards = np.array([r for _, _, r, _ in results], dtype=float)
+        costs = np.array([c for _, _, _, c in results], dtype=float)
+        return next_states, observations, rewards, costs
+
+    def observation_weights(self, ai, next_states, oi):
+        """
+        Probabilities of receiving observation oi after action ai, for each of the given next states
+
+        ai: action id
+        next_states: state ids
+        oi: observation id
+        return: array of Z(ai, sj, oi), aligned with next_states
+        """
+        action, obs = self.actions[ai], self.observations[oi]
+        return np.array([self.observation_function(action, self.states[sj], obs) for sj in next_states], dtype=float)
+
+    def next_belief(self, belief, ai, oi):
+        """
+        Exact Bayesian belief update b'(sj) ~ Z(ai, sj, oi) * sum_i T(ai, si, sj) * b(si)
+
+        belief: probabilities indexed by state id
+        ai: action id
+        oi: observation id
+        return: normalised new belief as an array
+        """
+        action, obs = self.actions[ai], self.observations[oi]
+        b_new = np.zeros(self.num_states)
+        for j, sj in enumerate(self.states):
+            p_o_prime = self.observation_function(action, sj, obs)
+            summation = 0.0
+            for i, si in enumerate(self.states):
+                summation += self.transition_function(action, si, sj) * float(belief[i])
+            b_new[j] = p_o_prime * summation
+        return b_new / b_new.sum()
+
+    def next_beliefs(self, beliefs, actions, observations):
+        """
+        next_belief over many beliefs at once
+
+        beliefs: (K, S) matrix
+        actions, observations: K action ids and observation ids
+        return: (K, S) matrix of normalised new beliefs
+        """
+        return np.array([self.next_belief(b, ai, oi) for b, ai, oi in zip(beliefs, actions, observations)])
+
+    def project(self, ai, oi, alphas):
+        """
+        Back-projects alpha vectors through action ai and observation oi (the Gamma^{a,o} set of PBVI):
+            v(si) = discount * sum_j T(ai, si, sj) * Z(ai, sj, oi) * alpha(sj)
+
+        alphas: (G, S) matrix, one alpha vector per row
+        return: (G, S) matrix of projected vectors
+        """
+        action, obs = self.actions[ai], self.observations[oi]
+        gamma = np.zeros((len(alphas), self.num_states))
+        for g, alpha in enumerate(alphas):
+            for i, si in enumerate(self.states):
+                for j, sj in enumerate(self.states):
+                    gamma[g, i] += self.transition_function(action, si, sj) * \
+                        self.observation_function(action, sj, obs) * \
+                        alpha[j]
+        return self.discount * gamma
+
+    def expected_values(self, values):
+        """
+        Expected next-state values under every action: E[V(sj) | si, a] = sum_j T(a, si, sj) * V(sj)
+
+        values: V, indexed by state id
+        return: (A, S) array
+        """
+        if self.__transitions is None:
+            S, A = self.states, self.actions
+            self.__transitions = np.array([[[self.transition_function(a, si, sj) for sj in S] for si in S] for a in A],
+                                          dtype=float)
+        return np.dot(self.__transitions, values)
+
+    def projection_matrices(self):
+        """
+        PBVI projection operators M[a, o] = discount * T[a] * diag(Z[a, :, o]), so that project(ai, oi, alphas)
+        is np.dot(alphas, M[ai, oi].T)
+
+        return: dense (A, O, S, S) array, or None when it would have more than MAX_PROJECTION_ENTRIES entries
+        """
+        S, A, O = self.states, self.actions, self.observations
+        if len(A) * len(O) * len(S) ** 2 > self.MAX_PROJECTION_ENTRIES:
+            return None
+        T = np.array([[[self.transition_function(a, si, sj) for sj in S] for si in S] for a in A], dtype=float)
+        Z = np.array([[[self.observation_function(a, sj, o) for o in O] for sj in S] for a in A], dtype=float)
+        return self.discount * T[:, None, :, :] * Z.transpose(0, 2, 1)[:, :, None, :]
+
     def take_action(self, action):
         """
         Accepts an action and changes the underlying environment state
@@ -1,8 +1,9 @@
-from models.model import Model
+from models.factored_model import FactoredModel
+import re
 
-class RockSampleModel(Model):
+class RockSampleModel(FactoredModel):
     def __init__(self, env):
-        Model.__init__(self, env)
-        size, num_rocks = self.model_spec.split('x')
+        FactoredModel.__init__(self, env)
+        size, num_rocks = re.split('[x_]', self.model_spec)
         self.size = int(size)
         self.num_rocks = int(num_rocks)
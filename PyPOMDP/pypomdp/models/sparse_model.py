@@ -0,0 +1,111 @@
+from models.compiled_model import CompiledModel
+from models.model import Model
+from util.sparse import CSRMatrix
+import numpy as np
+import random
+
+
+class SparseModel(CompiledModel):
+    def __init__(self, env):
+        """
+        Same expected attributes as Model, but T and Z only keep their nonzero entries, in CSR matrices whose row
+        (a, s) is stored at a * |S| + s:
+            T: (A * S, S) transition probabilities
+            Z: (A * S, O) observation probabilities
+        Z is also kept transposed by (a, o) rows, so that belief updates and PBVI projections only touch the
+        states able to emit an observation. Sampling, belief updates and projections all run in O(nnz), which keeps
+        large grid worlds (where every row has a handful of successors) in memory.
+        """
+        CompiledModel.__init__(self, env)
+
+    def compile(self):
+        """
+        Turns the parsed T and Z dicts into CSR matrices, without ever building a dense (A, S, S) tensor
+        """
+        row_ids = (self.action_ids, self.state_ids)
+        self.T = CSRMatrix.from_dict(self.T, row_ids, self.state_ids)
+        self.Z = CSRMatrix.from_dict(self.Z, row_ids, self.observation_ids)
+
+    def build_samplers(self):
+        self.Zt = self.Z.transpose_blocks(self.num_states)
+        self.T_prob, self.T_alias = self.T.alias_tables()
+        self.Z_prob, self.Z_alias = self.Z.alias_tables()
+        self.T_keys, self.Z_keys = self.T.cdf_keys(), self.Z.cdf_keys()
+
+    def __lookup(self, matrix, row, col):
+        cols, vals = matrix.row(row)
+        k = np.searchsorted(cols, col)
+        return vals[k] if k < len(cols) and cols[k] == col else 0.0
+
+    def observation_function(self, action, state, obs):
+        row = self.action_ids[action] * self.num_states + self.state_ids[state]
+        return self.__lookup(self.Z, row, self.observation_ids[obs])
+
+    def transition_function(self, action, si, sj):
+        row = self.action_ids[action] * self.num_states + self.state_ids[si]
+        return self.__lookup(self.T, row, self.state_ids[sj])
+
+    def transition_probs(self, ai, si):
+        return self.T.dense_row(ai * self.num_states + si)
+
+    def observation_probs(self, ai, sj):
+        return self.Z.dense_row(ai * self.num_states + sj)
+
+    def __draw(self, matrix, prob, alias, row):
+        start, end = matrix.indptr[row], matrix.indptr[row + 1]
+        if start == end:
+            # no stored successor: uniform, like an all-zero dense row
+            return int(random.random() * matrix.shape[1])
+        k = start + int(random.random() * (end - start))
+        if random.random() >= prob[k]:
+            k = start + alias[k]
+        return int(matrix.indices[k])
+
+    def simulate_action_id(self, si, ai):
+        sj = self.__draw(self.T, self.T_prob, self.T_alias, ai * self.num_states + si)
+        oj = self.__draw(self.Z, self.Z_prob, self.Z_alias, ai * self.num_states + sj)
+        return sj, oj, self.R[ai, si], self.C[ai]
+
+    def simulate_batch(self, states, actions):
+        states = np.asarray(states, dtype=int)
+        actions = np.broadcast_to(np.asarray(actions, dtype=int), states.shape)
+
+        next_states = self.T.sample_rows(self.T_keys, actions * self.num_states + states)
+        observations = self.Z.sample_rows(self.Z_keys, actions * self.num_states + next_states)
+        return next_states, observations, self.R[actions, states], self.C[actions]
+
+    def observation_weights(self, ai, next_states, oi):
+        return self.Zt.dense_row(ai * len(self.observations) + oi)[np.asarray(next_states, dtype=int)]
+
+    def __entries(self, ai):
+        """
+        Stored T entries of action ai: start rows, next states and probabilities
+        """
+        n = self.num_states
+        start, end = self.T.indptr[ai * n], self.T.indptr[(ai + 1) * n]
+        return self.T.rows[start:end] - ai * n, self.T.indices[start:end], self.T.data[start:end]
+
+    def next_belief(self, belief, ai, oi):
+        rows, cols, probs = self.__entries(ai)
+        predicted = np.bincount(cols, weights=probs * np.asarray(belief)[rows], minlength=self.num_states)
+        b_new = self.Zt.dense_row(ai * len(self.observations) + oi) * predicted
+        return b_new / b_new.sum()
+
+    def next_beliefs(self, beliefs, actions, observations):
+        # one sparse update per belief, as the dense per-action products would need T[a] as a matrix
+        return Model.next_beliefs(self, beliefs, actions, observations)
+
+    def expected_values(self, values):
+        n = self.num_states
+        weights = self.T.data * np.asarray(values, dtype=float)[self.T.indices]
+        return self.T.row_sums(weights, 0, self.T.shape[0]).reshape(-1, n)
+
+    def projection_matrices(self):
+        # (A, O, S, S) is what the sparse backend avoids: projections go through project instead
+        return None
+
+    def project(self, ai, oi, alphas):
+        rows, cols, probs = self.__entries(ai)
+        z = self.Zt.dense_row(ai * len(self.observations) + oi)
+        weights = np.asarray(alphas)[:, cols] * (probs * z[cols])
+        return self.discount * self.T.row_sums(weights, ai * self.num_states, self.num_states)
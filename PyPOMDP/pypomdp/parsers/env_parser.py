@@ -6,54 +6,257 @@
 from copy import deepcopy
 from numpy import *
 from util.helper import gen_distribution
+from util.sparse import CSRMatrix
 from numpy import random
+import numpy as np
+from xml.etree.ElementTree import iterparse
+import hashlib
+import json
 import os
 import itertools
 
+# bump whenever the layout of the compiled cache files changes
+CACHE_VERSION = '1'
+
 
 class PomdpxParser:
-    # TODO
-    pass
+    # value names used by POMDPX when a variable only declares <NumValues>
+    VALUE_PREFIXES = {'StateVar': 's', 'ObsVar': 'o', 'ActionVar': 'a'}
+    SECTIONS = {'InitialStateBelief': 'initial_belief', 'StateTransitionFunction': 'transition',
+                'ObsFunction': 'observation', 'RewardFunction': 'reward'}
+
+    def __init__(self, config_file):
+        '''
+        Parses a .pomdpx file into a factored model: state variables keep their own conditional probability
+        tables (over their parents only) and are never flattened into a joint T, Z or R.
+        '''
+        self.config_file = config_file
+        self.model_name = None
+        self.model_spec = None
+
+        self.discount, self.values = None, 'reward'
+        self.state_vars, self.obs_vars, self.action_var, self.reward_var = [], [], None, None
+        self.initial_belief, self.transition, self.observation, self.reward = [], [], [], []
+        self.domains = {}   # variable name -> {value name: index}
+
+    def __enter__(self):
+        self.__get_model()
+
+        section = None
+        with open(self.config_file, 'rb') as f:
+            # stream the xml: every element is handled, then dropped, as soon as it is complete
+            for event, elem in iterparse(f, events=('start', 'end')):
+                if event == 'start':
+                    section = self.SECTIONS.get(elem.tag, section)
+                    continue
+
+                if elem.tag == 'Discount':
+                    self.discount = float(elem.text)
+                elif elem.tag in self.VALUE_PREFIXES or elem.tag == 'RewardVar':
+                    self.__get_variable(elem)
+                elif elem.tag in ('CondProb', 'Func'):
+                    getattr(self, section).append(self.__get_table(elem))
+                elif elem.tag in self.SECTIONS:
+                    section = None
+                else:
+                    continue
+                elem.clear()
+
+        return self
+
+    def __exit__(self, ctx_type, ctx_value, ctx_traceback):
+        self = None
+
+    def __get_model(self):
+        fname = os.path.basename(self.config_file)
+        name = fname.split('.')[0]
+        if '-' in name:
+            self.model_name, self.model_spec = name.split('-')
+        else:
+            self.model_name = name
+
+    def __get_variable(self, elem):
+        if elem.tag == 'RewardVar':
+            self.reward_var = elem.get('vname')
+            return
+
+        enum, num = elem.find('ValueEnum'), elem.find('NumValues')
+        if enum is not None:
+            values = enum.text.split()
+        else:
+            values = [self.VALUE_PREFIXES[elem.tag] + str(i) for i in range(int(num.text))]
+
+        if elem.tag == 'StateVar':
+            var = {'prev': elem.get('vnamePrev'), 'curr': elem.get('vnameCurr'), 'values': values,
+                   'fully_observed': elem.get('fullyObs') == 'true'}
+            self.state_vars.append(var)
+            names = [var['prev'], var['curr']]
+        elif elem.tag == 'ObsVar':
+            self.obs_vars.append({'name': elem.get('vname'), 'values': values})
+            names = [elem.get('vname')]
+        else:
+            self.action_var = {'name': elem.get('vname'), 'values': values}
+            names = [elem.get('vname')]
+
+        for name in names:
+            self.domains[name] = {v: i for i, v in enumerate(values)}
+
+    def __get_table(self, elem):
+        '''
+        Builds the dense table of a <CondProb> (parents + variable dimensions) or of a <Func> (parents only)
+        from its TBL entries. In an <Instance>, '*' applies the same numbers to every value of a dimension and '-'
+        enumerates the dimension in the <ProbTable> / <ValueTable>; later entries override earlier ones.
+        '''
+        var = elem.findtext('Var').strip()
+        parents = elem.findtext('Parent').split()
+        parents = [] if parents == ['null'] else parents
+
+        parameter = elem.find('Parameter')
+        if parameter.get('type', 'TBL').strip() != 'TBL':
+            raise Exception("Unsupported parameter type: " + parameter.get('type'))
+
+        dims = parents if elem.tag == 'Func' else parents + [var]
+        sizes = [len(self.domains[d]) for d in dims]
+        table = np.zeros(sizes)
+
+        for entry in parameter.iter('Entry'):
+            tokens = entry.findtext('Instance').split()
+            if len(tokens) != len(dims):
+                raise Exception("Cannot parse instance: {} for {}".format(tokens, dims))
+
+            index, shape = [], []
+            for token, dim, size in zip(tokens, dims, sizes):
+                if token in ('*', '-'):
+                    index.append(slice(None))
+                    shape.append(size if token == '-' else 1)
+                else:
+                    index.append(self.domains[dim][token])
+
+            text = entry.findtext('ProbTable' if elem.tag == 'CondProb' else 'ValueTable').strip()
+            if text == 'uniform':
+                values = 1.0 / sizes[-1]
+            elif text == 'identity':
+                values = np.eye(sizes[-1]).reshape(shape)
+            else:
+                values = np.array(text.split(), dtype=float).reshape(shape)
+            table[tuple(index)] = values
+
+        table.flags.writeable = False
+        return {'var': var, 'parents': parents, 'table': table}
+
+    def copy_env(self):
+        '''
+        The factored tables are read-only and shared by every model created from this parser
+        '''
+        return {
+            "factored": True,
+            "model_name": self.model_name,
+            "model_spec": self.model_spec,
+            "discount": self.discount,
+            "values": self.values,
+            "init_state": None,
+            "start": None,
+            "costs": None,
+            "state_vars": deepcopy(self.state_vars),
+            "obs_vars": deepcopy(self.obs_vars),
+            "action_var": deepcopy(self.action_var),
+            "initial_belief": list(self.initial_belief),
+            "transition": list(self.transition),
+            "observation": list(self.observation),
+            "reward": list(self.reward),
+        }
+
+    def copy_sparse_env(self):
+        return self.copy_env()
+
+    def random_beliefs(self):
+        n_states = int(np.prod([len(var['values']) for var in self.state_vars]))
+        return gen_distribution(n_states)
+
+    def generate_beliefs(self):
+        '''
+        Joint initial belief, as the product of the independent initial distribution of every state variable
+        '''
+        belief = np.ones(1)
+        priors = {cpt['var']: cpt for cpt in self.initial_belief}
+        for var in self.state_vars:
+            cpt = priors.get(var['prev'])
+            if cpt is None:
+                prior = np.ones(len(var['values'])) / len(var['values'])
+            elif cpt['parents']:
+                raise Exception("Correlated initial beliefs are not supported: " + var['prev'])
+            else:
+                prior = cpt['table']
+            belief = np.outer(belief, prior).ravel()
+        return belief.tolist()
 
 
 class PomdpParser:
-    def __init__(self, config_file):
+    def __init__(self, config_file, compiled=False, cache_dir=None):
         '''
         Parses .pomdp file and loads info into this object's fields.
+
+        In compiled mode, T, Z and R entries are recorded straight under integer ids (positions in states, actions
+        and observations) instead of being put in dicts keyed by names; copy_env and copy_sparse_env then hand out
+        arrays built once from them. With a cache_dir, the compiled entries are saved as an .npz keyed by a hash of
+        the file, so that later runs on the same file skip parsing entirely.
         '''
         self.config_file = config_file
+        self.compiled = compiled
+        self.cache_dir = cache_dir
         self.model_name = None
         self.model_spec = None
 
         self.T, self.Z, self.R = {}, {}, {}
-        self.discount, self.start, self.init_state = None, None, None
+        self.tables = {'T': self.T, 'Z': self.Z, 'R': self.R}
+        self.discount, self.start, self.init_state, self.values = None, None, None, None
         self.states, self.actions, self.observations, self.costs = None, None, None, None
 
+        # compiled mode: name -> id maps, (ids..., value) entries per table and the arrays built from them
+        self.ids = {}
+        self.entries = {'T': [], 'Z': [], 'R': []}
+        self.coo = None
+        self.__dense, self.__sparse = None, None
+
     def __enter__(self):
-        attrs = ['init_state', 'start', 'discount', 'values', 'states', 'actions', 'costs', 'observations', 'T', 'O', 'R']
+        self.__get_model()
+        if self.compiled and self.__load_cache():
+            return self
+
+        handlers = {
+            'init_state': self.__get_init_state,
+            'start': self.__get_start,
+            'discount': self.__get_discount,
+            'values': self.__get_values,
+            'states': self.__get_states,
+            'actions': self.__get_actions,
+            'costs': self.__get_costs,
+            'observations': self.__get_observations,
+            'T': self.__get_T,
+            'O': self.__get_O,
+            'R': self.__get_R,
+        }
 
         with open(self.config_file, 'r') as f:
-            self.contents = [
-                x.strip() for x in f.readlines()
-                if not x.startswith("#") and not x.isspace()
-            ]
-            self.__get_model()
-
-            # go through line by line and extract configurations
-            i = 0
-            while i < len(self.contents):
-                line = self.contents[i]
-                attr = [a for a in attrs if line.startswith(a)]
-
-                if not attr:
+            # stream the file once and dispatch every line on its keyword
+            self.lines = (x.strip() for x in f if not x.startswith("#") and not x.isspace())
+            for line in self.lines:
+                handler = handlers.get(line.split(':', 1)[0].strip())
+                if handler is None:
                     raise Exception("Unrecognized line: " + line)
-                i = getattr(self, '_PomdpParser__get_' + attr[0])(i)
+                handler(line)
 
+        if self.compiled:
+            self.__compile_entries()
+            self.__save_cache()
         return self
 
     def __exit__(self, ctx_type, ctx_value, ctx_traceback):
         self = None
 
+    def __next_line(self):
+        return next(self.lines)
+
     def __get_model(self):
         fname = os.path.basename(self.config_file)
         if '-' in fname:
@@ -63,98 +266,107 @@ class PomdpParser:
         else:
             self.model_name = fname.split('.')[0]
 
-    def __get_discount(self, i):
-        line = self.contents[i]
+    def __get_discount(self, line):
         self.discount = float(line.split()[1])
-        return i + 1
 
-    def __get_values(self, i):
+    def __get_values(self, line):
         # Currently just supports "values: reward". I.e. currently
         # meaningless.
-        line = self.contents[i]
         self.values = line.split()[1]
-        return i + 1
 
-    def __parse_line__(self, i, attr):
-        parts = self.contents[i].split()
+    def __parse_line__(self, line, attr):
+        parts = line.split()
 
         if len(parts) == 2:
             n = int(parts[1])
             setattr(self, attr, list(map(str, list(range(n)))))
         else:
             setattr(self, attr, parts[1:])
-        return i + 1
+        self.ids[attr] = {name: i for i, name in enumerate(getattr(self, attr))}
 
-    def __get_init_state(self, i):
-        line = self.contents[i]
+    def __get_init_state(self, line):
         self.init_state = line.split()[1]
-        return i + 1
 
-    def __get_states(self, i):
-        return self.__parse_line__(i, 'states')
+    def __get_states(self, line):
+        self.__parse_line__(line, 'states')
+
+    def __get_actions(self, line):
+        self.__parse_line__(line, 'actions')
 
-    def __get_actions(self, i):
-        return self.__parse_line__(i, 'actions')
+    def __get_observations(self, line):
+        self.__parse_line__(line, 'observations')
 
-    def __get_observations(self, i):
-        return self.__parse_line__(i, 'observations')
-    
-    def __get_start(self, i):
-        j = self.__parse_line__(i, 'start')
+    def __get_start(self, line):
+        self.__parse_line__(line, 'start')
         self.start = list(map(float, self.start))
-        return j
 
-    def __get_costs(self, i):
-        j = self.__parse_line__(i, 'costs')
+    def __get_costs(self, line):
+        self.__parse_line__(line, 'costs')
         self.costs = list(map(float, self.costs))
-        return j
 
-    def __get_T(self, i):
-        line = self.contents[i]
+    def __set(self, table, key, prob):
+        '''
+        Records a T, Z or R entry: under its names in the parsed dicts or, in compiled mode, under integer ids.
+        Names that are not declared are dropped in compiled mode, as they would never be looked up by the model,
+        and so are rewards other than the (action, start-state, *, *) ones read by Model.reward_function
+        '''
+        if not self.compiled:
+            self.tables[table][key] = prob
+            return
+
+        actions, states = self.ids['actions'], self.ids['states']
+        if table == 'R':
+            if key[2] != '*' or key[3] != '*':
+                return
+            ids = (actions.get(key[0]), states.get(key[1]))
+        else:
+            columns = self.ids['states' if table == 'T' else 'observations']
+            ids = (actions.get(key[0]), states.get(key[1]), columns.get(key[2]))
+        if None not in ids:
+            self.entries[table].append(ids + (prob,))
+
+    def __set_identity(self, table, action, columns):
+        if self.compiled:
+            # the zeros are implicit in compiled mode
+            for state in self.states:
+                self.__set(table, (action, state, state), 1.0)
+            return
+        for comb in itertools.product([action], self.states, columns):
+            self.__set(table, comb, 1.0 if comb[1] == comb[2] else 0.0)
+
+    def __get_T(self, line):
         pieces = [x for x in line.split() if (x.find(':') == -1)]
-        # try:
-        #     pieces = map(float, pieces)
-        # except Exception:
-        #     pass
         action = pieces[0]
 
         if len(pieces) == 4:
             # case 1: T: <action> : <start-state> : <next-state> %f
             start_state, next_state = pieces[1], pieces[2]
-            self.T[(action, start_state, next_state)] = float(pieces[3])
-            return i + 1
+            self.__set('T', (action, start_state, next_state), float(pieces[3]))
         elif len(pieces) == 3:
             # case 2: T: <action> : <start-state> : <next-state>
             # %f
             start_state, next_state = pieces[1], pieces[2]
-            self.T[(action, start_state, next_state)] = float(self.contents[i+1])
-            return i + 2
+            self.__set('T', (action, start_state, next_state), float(self.__next_line()))
         elif len(pieces) == 2:
             # case 3: T: <action> : <start-state>
             # %f %f ... %f
             start_state = pieces[1]
-            next_line = self.contents[i+1]
-            probs = next_line.split()
+            probs = self.__next_line().split()
             assert len(probs) == len(self.states)
-            for j, prob in enumerate(probs):
-                self.T[(action, start_state, j)] = float(prob)
-            return i + 2
+            for sj, prob in zip(self.states, probs):
+                self.__set('T', (action, start_state, sj), float(prob))
         elif len(pieces) == 1:
-            next_line = self.contents[i+1]
+            next_line = self.__next_line()
             if next_line == "identity":
                 # case 4: T: <action>
                 # identity
-                # map(lambda tprob: self.T[tprob] = 1.0 if tprob[1] == tprob[2] else 0.0, [])
-                for comb in itertools.product([action], self.states, self.states):
-                    self.T[(action, comb[1], comb[2])] = 1.0 if comb[1] == comb[2] else 0.0
-                return i + 2
+                self.__set_identity('T', action, self.states)
             elif next_line == "uniform":
                 # case 5: T: <action>
                 # uniform
                 prob = 1.0 / float(len(self.states))
                 for comb in itertools.product([action], self.states, self.states):
-                    self.T[comb] = prob
-                return i + 2
+                    self.__set('T', comb, prob)
             else:
                 # case 6: T: <action>
                 # %f %f ... %f
@@ -162,63 +374,46 @@ class PomdpParser:
                 # ...
                 # %f %f ... %f
                 for j, sj in enumerate(self.states):
-                    probs = next_line.split()
+                    probs = (next_line if j == 0 else self.__next_line()).split()
                     assert len(probs) == len(self.states)
-                    for k, sk in enumerate(self.states):
-                        prob = float(probs[k])
-                        self.T[(action, sj, sk)] = prob
-                    next_line = self.contents[i+2+j]
-                return i+1+len(self.states)
+                    for sk, prob in zip(self.states, probs):
+                        self.__set('T', (action, sj, sk), float(prob))
         else:
             raise Exception("Cannot parse line " + line)
 
-    def __get_O(self, i):
-        line = self.contents[i]
+    def __get_O(self, line):
         pieces = [x for x in line.split() if (x.find(':') == -1)]
-        # try:
-        #     pieces = map(float, pieces)
-        # except Exception:
-        #     pass
         action = pieces[0]
 
         if len(pieces) == 4:
             # case 1: O: <action> : <next-state> : <obs> %f
             next_state, obs, prob = pieces[1], pieces[2], float(pieces[3])
-            self.Z[(action, next_state, obs)] = prob
-            return i + 1
+            self.__set('Z', (action, next_state, obs), prob)
         elif len(pieces) == 3:
             # case 2: O: <action> : <next-state> : <obs>
             # %f
             next_state, obs = pieces[1], pieces[2]
-            next_line = self.contents[i+1]
-            prob = float(next_line)
-            self.Z[(action, next_state, obs)] = prob
-            return i + 2
+            self.__set('Z', (action, next_state, obs), float(self.__next_line()))
         elif len(pieces) == 2:
             # case 3: O: <action> : <next-state>
             # %f %f ... %f
             next_state = pieces[1]
-            next_line = self.contents[i+1]
-            probs = next_line.split()
+            probs = self.__next_line().split()
             assert len(probs) == len(self.observations)
-            for j, obs in enumerate(self.observations):
-                self.Z[(action, next_state, obs)] = float(probs[j])
-            return i + 2
+            for obs, prob in zip(self.observations, probs):
+                self.__set('Z', (action, next_state, obs), float(prob))
         elif len(pieces) == 1:
-            next_line = self.contents[i+1]
+            next_line = self.__next_line()
             if next_line == "identity":
                 # case 4: O: <action>
                 # identity
-                for comb in itertools.product([action], self.states, self.observations):
-                    self.Z[comb] = 1.0 if comb[1] == comb[2] else 0.0
-                return i + 2
+                self.__set_identity('Z', action, self.observations)
             elif next_line == "uniform":
                 # case 5: O: <action>
                 # uniform
                 prob = 1.0 / float(len(self.observations))
                 for comb in itertools.product([action], self.states, self.observations):
-                    self.Z[comb] = prob
-                return i + 2
+                    self.__set('Z', comb, prob)
             else:
                 # case 6: O: <action>
                 # %f %f ... %f
@@ -226,27 +421,20 @@ class PomdpParser:
                 # ...
                 # %f %f ... %f
                 for j, sj in enumerate(self.states):
-                    probs = next_line.split()
+                    probs = (next_line if j == 0 else self.__next_line()).split()
                     assert len(probs) == len(self.observations)
-                    for k, oj in enumerate(self.observations):
-                        self.Z[(action, sj, oj)] = prob = float(probs[k])
-                    next_line = self.contents[i + 2 + j]
-                return i + 1 + len(self.states)
+                    for oj, prob in zip(self.observations, probs):
+                        self.__set('Z', (action, sj, oj), float(prob))
         else:
             raise Exception("Cannot parse line: " + line)
 
-    def __get_R(self, i):
+    def __get_R(self, line):
         '''
         Wild card * are allowed when specifying a single reward
         probability. They are not allowed when specifying a vector or
         matrix of probabilities.
         '''
-        line = self.contents[i]
         pieces = [x for x in line.split() if (x.find(':') == -1)]
-        # try:
-        #     pieces = map(float, pieces)
-        # except Exception:
-        #     pass
         action = pieces[0]
 
         if len(pieces) == 5 or len(pieces) == 4:
@@ -254,27 +442,17 @@ class PomdpParser:
             # R: <action> : <start-state> : <next-state> : <obs> %f
             # any of <start-state>, <next-state>, and <obs> can be *
             # %f can be on the next line (case where len(pieces) == 4)
-            # start_state_raw = pieces[1]
-            # next_state_raw = pieces[2]
-            # obs_raw = pieces[3]
             start_state, next_state, obs = pieces[1], pieces[2], pieces[3]
-            prob = float(pieces[4]) if len(pieces) == 5 else float(self.contents[i+1])
-
-            # self.__reward_ss(
-            #     action, start_state_raw, next_state_raw, obs_raw, prob)
-
-            self.R[(action, start_state, next_state, obs)] = prob
-            return i + 1 if len(pieces) == 5 else i + 2
+            prob = float(pieces[4]) if len(pieces) == 5 else float(self.__next_line())
+            self.__set('R', (action, start_state, next_state, obs), prob)
         elif len(pieces) == 3:
             # case 2: R: <action> : <start-state> : <next-state>
             # %f %f ... %f
             start_state, next_state = pieces[1], pieces[2]
-            next_line = self.contents[i+1]
-            probs = next_line.split()
+            probs = self.__next_line().split()
             assert len(probs) == len(self.observations)
-            for j, obs in enumerate(self.observations):
-                self.R[(action, start_state, next_state, obs)] = float(probs[j])
-            return i + 2
+            for obs, prob in zip(self.observations, probs):
+                self.__set('R', (action, start_state, next_state, obs), float(prob))
         elif len(pieces) == 2:
             # case 3: R: <action> : <start-state>
             # %f %f ... %f
@@ -282,18 +460,72 @@ class PomdpParser:
             # ...
             # %f %f ... %f
             start_state = pieces[1]
-            next_line = self.contents[i+1]
-            for j, sj in enumerate(self.states):
-                probs = next_line.split()
+            for sj in self.states:
+                probs = self.__next_line().split()
                 assert len(probs) == len(self.observations)
-                for k, oj in enumerate(self.observations):
-                    prob = float(probs[k])
-                    self.R[(action, start_state, sj, oj)] = prob
-                next_line = self.contents[i + 2 + j]
-            return i + 1 + len(self.states)
+                for oj, prob in zip(self.observations, probs):
+                    self.__set('R', (action, start_state, sj, oj), float(prob))
         else:
             raise Exception("Cannot parse line: " + line)
 
+    def __compile_entries(self):
+        '''
+        Turns the recorded entries into (ids..., values) arrays. Repeated cells keep their last value, the same way
+        they overwrite each other in the parsed dicts
+        '''
+        self.coo = {}
+        for table, entries in self.entries.items():
+            n_ids = 2 if table == 'R' else 3
+            cols = np.array(entries, dtype=float).reshape(-1, n_ids + 1).T
+            ids = cols[:n_ids].astype(np.int64)
+
+            keys = np.ravel_multi_index(tuple(ids), self.__shape(table)) if len(entries) else ids[0]
+            _, last = np.unique(keys[::-1], return_index=True)
+            keep = np.sort(len(keys) - 1 - last)
+            self.coo[table] = tuple(ids[:, keep]) + (cols[n_ids, keep],)
+        self.entries = None
+
+    def __shape(self, table):
+        n_a, n_s, n_o = len(self.actions), len(self.states), len(self.observations)
+        return {'T': (n_a, n_s, n_s), 'Z': (n_a, n_s, n_o), 'R': (n_a, n_s)}[table]
+
+    def __cache_file(self):
+        sha = hashlib.sha1(CACHE_VERSION.encode())
+        with open(self.config_file, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                sha.update(chunk)
+        return os.path.join(self.cache_dir, '{}-{}.npz'.format(os.path.basename(self.config_file), sha.hexdigest()))
+
+    def __load_cache(self):
+        if self.cache_dir is None:
+            return False
+        path = self.__cache_file()
+        if not os.path.exists(path):
+            return False
+
+        with np.load(path) as data:
+            for k, v in json.loads(str(data['meta'])).items():
+                setattr(self, k, v)
+            self.coo = {
+                'T': tuple(data['T'][:3].astype(np.int64)) + (data['T'][3],),
+                'Z': tuple(data['Z'][:3].astype(np.int64)) + (data['Z'][3],),
+                'R': tuple(data['R'][:2].astype(np.int64)) + (data['R'][2],),
+            }
+        for attr in ('states', 'actions', 'observations'):
+            self.ids[attr] = {name: i for i, name in enumerate(getattr(self, attr))}
+        return True
+
+    def __save_cache(self):
+        if self.cache_dir is None:
+            return
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+        meta = {k: getattr(self, k) for k in ('discount', 'values', 'init_state', 'start', 'states', 'actions',
+                                              'observations', 'costs')}
+        np.savez(self.__cache_file(), meta=json.dumps(meta),
+              **{table: np.vstack(entries) for table, entries in self.coo.items()})
+
     def __reward_ss(self, a, start_state_raw, next_state_raw, obs_raw, prob):
         '''
         reward_ss means we're at the start state of the unrolling of the
@@ -335,7 +567,7 @@ class PomdpParser:
             obs = self.observations.index(obs_raw)
             self.R[(a, start_state, next_state, obs)] = prob
 
-    def copy_env(self):
+    def __copy_meta(self):
         return {
             "model_name": self.model_name,
             "model_spec": self.model_spec,
@@ -347,10 +579,58 @@ class PomdpParser:
             "costs": deepcopy(self.costs),
             "actions": deepcopy(self.actions),
             "observations": deepcopy(self.observations),
+        }
+
+    def __dense_arrays(self):
+        '''
+        Dense T, Z and R built once from the compiled entries. They are shared, read-only, by every copy_env call
+        '''
+        if self.__dense is None:
+            self.__dense = {}
+            for table, entries in self.coo.items():
+                arr = np.zeros(self.__shape(table))
+                arr[entries[:-1]] = entries[-1]
+                arr.flags.writeable = False
+                self.__dense[table] = arr
+        return self.__dense
+
+    def copy_env(self):
+        env = self.__copy_meta()
+        if self.compiled:
+            env.update(self.__dense_arrays())
+            return env
+
+        env.update({
             "T": deepcopy(self.T),
             "Z": deepcopy(self.Z),
             "R": deepcopy(self.R)
-        }
+        })
+        return env
+
+    def copy_sparse_env(self):
+        """
+        Same as copy_env, but T and Z are built straight from the parsed entries into CSR matrices (see SparseModel)
+        """
+        env = self.__copy_meta()
+        if self.compiled:
+            if self.__sparse is None:
+                n_s = len(self.states)
+                (ta, ts, tj, tp), (za, zs, zo, zp) = self.coo['T'], self.coo['Z']
+                self.__sparse = {
+                    "T": CSRMatrix.from_coo(ta * n_s + ts, tj, tp, (len(self.actions) * n_s, n_s)),
+                    "Z": CSRMatrix.from_coo(za * n_s + zs, zo, zp, (len(self.actions) * n_s, len(self.observations))),
+                    "R": self.__dense_arrays()["R"],
+                }
+            env.update(self.__sparse)
+            return env
+
+        action_ids, state_ids, observation_ids = self.ids['actions'], self.ids['states'], self.ids['observations']
+        env.update({
+            "T": CSRMatrix.from_dict(self.T, (action_ids, state_ids), state_ids),
+            "Z": CSRMatrix.from_dict(self.Z, (action_ids, state_ids), observation_ids),
+            "R": deepcopy(self.R)
+        })
+        return env
 
     def random_beliefs(self):
         return gen_distribution(len(self.states))
@@ -1,7 +1,6 @@
 import json
 import graphviz
 from abc import abstractmethod
-from util.belief_tree import Node, ActionNode, BeliefNode
 
 class TreeVisualiser(object):
 
@@ -10,7 +9,7 @@ class TreeVisualiser(object):
         self.graph = None
 
     @abstractmethod
-    def update(self, root, append_to=None):
+    def update(self, tree, append_to=None):
         """
         To be implemented by visualiser
         """
@@ -28,22 +27,19 @@ class GraphViz(TreeVisualiser):
         TreeVisualiser.__init__(self, description)
         # self.graph = graphviz.Digraph(description)
 
-    def update(self, node, parent=None):
+    def update(self, tree, parent=None):
         self.graph = graphviz.Digraph(self.description)
         self.graph.attr(rankdir='LR')
-        self.__update(node)
+        self.__update(tree, tree.root)
         if parent:
-            self.graph.edge(parent, node)
+            self.graph.edge(parent, tree.node_str(tree.root))
 
     def render(self, fname=None, directory=None):
         self.graph.render(filename=fname, directory=directory)
 
-    def __update(self, node):
-        if not node.children:
-            return
-
-        for ch in node.children:
-            self.graph.edge(str(node), str(ch), label=ch.name )
-            self.__update(ch)
+    def __update(self, tree, node):
+        for ch in tree.children(node):
+            self.graph.edge(tree.node_str(node), tree.node_str(ch), label=tree.name(ch))
+            self.__update(tree, ch)
 
 
@@ -1,9 +1,9 @@
 import os
 import numpy as np
 import random
-from models import RockSampleModel, Model
-from solvers import POMCP, PBVI
-from parsers import PomdpParser, GraphViz
+from models import RockSampleModel, Model, CompiledModel, SparseModel, FactoredModel
+from solvers import POMCP, PBVI, Perseus, HSVI, QMDP, FIB
+from parsers import PomdpParser, PomdpxParser, GraphViz
 from logger import Logger as log
 
 
@@ -20,10 +20,41 @@ class PomdpRunner:
         :param env_configs: the complete encapsulation of environment's dynamics
         :return: concrete model
         """
-        MODELS = {
-            'RockSample': RockSampleModel,
+        if env_configs.get('factored'):
+            # POMDPX models are sampled variable by variable, whatever the backend
+            FACTORED_MODELS = {
+                'RockSample': RockSampleModel,
+            }
+            return FACTORED_MODELS.get(env_configs['model_name'], FactoredModel)(env_configs)
+
+        BACKENDS = {
+            'dense': CompiledModel,
+            'sparse': SparseModel,
         }
-        return MODELS.get(env_configs['model_name'], Model)(env_configs)
+        if self.params.backend in BACKENDS:
+            return BACKENDS[self.params.backend](env_configs)
+        return Model(env_configs)
+
+    def create_parser(self):
+        """
+        The dict backend needs the entries keyed by names; every other backend gets them compiled to integer ids,
+        cached on disk between runs. POMDPX files are always read into factored tables
+        """
+        if self.params.env_config.endswith('.pomdpx'):
+            return PomdpxParser(self.params.env_config)
+        if self.params.backend == 'dict':
+            return PomdpParser(self.params.env_config)
+        return PomdpParser(self.params.env_config, compiled=True, cache_dir=self.params.cache_folder)
+
+    def load_env(self, ctx):
+        """
+        Copies the parsed environment in the layout expected by the chosen model backend
+        :param ctx: PomdpParser context
+        :return: environment configs for create_model
+        """
+        if self.params.backend == 'sparse':
+            return ctx.copy_sparse_env()
+        return ctx.copy_env()
 
     def create_solver(self, algo, model):
         """
@@ -34,12 +65,16 @@ class PomdpRunner:
         """
         SOLVERS = {
             'pbvi': PBVI,
+            'perseus': Perseus,
+            'hsvi': HSVI,
+            'qmdp': QMDP,
+            'fib': FIB,
             'pomcp': POMCP,
         }
         return SOLVERS.get(algo)(model)
 
     def snapshot_tree(self, visualiser, tree, filename):
-        visualiser.update(tree.root)
+        visualiser.update(tree)
         visualiser.render('./dev/snapshots/{}'.format(filename))  # TODO: parametrise the dev folder path
 
     def run(self, algo, T, **kwargs):
@@ -48,19 +83,28 @@ class PomdpRunner:
         total_rewards, budget = 0, params.budget
 
         log.info('~~~ initialising ~~~')
-        with PomdpParser(params.env_config) as ctx:
+        with self.create_parser() as ctx:
             # creates model and solver
-            model = self.create_model(ctx.copy_env())
+            model = self.create_model(self.load_env(ctx))
             pomdp = self.create_solver(algo, model)
 
             # supply additional algo params
             belief = ctx.random_beliefs() if params.random_prior else ctx.generate_beliefs()
 
-            if algo == 'pbvi':
+            if isinstance(pomdp, QMDP):
+                pomdp.add_configs(epsilon=kwargs.get('epsilon', 1e-6))
+            elif isinstance(pomdp, HSVI):
+                # HSVI explores the beliefs reachable from the initial one by itself
+                pomdp.add_configs(belief, epsilon=kwargs.get('epsilon', 0.01), lp_prune=kwargs.get('lp_prune', False))
+            elif isinstance(pomdp, PBVI):
                 #belief_points = ctx.generate_belief_points(kwargs['stepsize'])
                 belief_points = pomdp.generate_reachable_belief_points(belief, 50)
                 #print(belief_points)
-                pomdp.add_configs(belief_points)
+                pomdp.add_configs(belief_points, lp_prune=kwargs.get('lp_prune', False), epsilon=kwargs.get('epsilon'),
+                                  error_bound=kwargs.get('error_bound', False), init=kwargs.get('init', 'zero'),
+                                  num_workers=kwargs.get('num_workers', 1),
+                                  warm_start=kwargs.get('warm_start'),
+                                  warm_start_lower_bound=kwargs.get('warm_start_lower_bound', False))
             elif algo == 'pomcp':
                 pomdp.add_configs(budget, belief, **kwargs)
 
@@ -74,34 +118,42 @@ class PomdpRunner:
             Max Play: {}
         ++++++++++++++++++++++'''.format(model.curr_state, budget, belief, T, params.max_play))
 
-        for i in range(params.max_play):
-            # plan, take action and receive environment feedbacks
-            pomdp.solve(T)
-            action = pomdp.get_action(belief)
-            new_state, obs, reward, cost = pomdp.take_action(action)
+        try:
+            for i in range(params.max_play):
+                # plan, take action and receive environment feedbacks
+                pomdp.solve(T)
+                action = pomdp.get_action(belief)
+                if isinstance(pomdp, POMCP):
+                    # keeps searching while the action executes
+                    pomdp.start_pondering(action, T)
+                new_state, obs, reward, cost = pomdp.take_action(action)
 
-            if params.snapshot and isinstance(pomdp, POMCP):
-                # takes snapshot of belief tree before it gets updated
-                self.snapshot_tree(visualiser, pomdp.tree, '{}.gv'.format(i))
+                if params.snapshot and isinstance(pomdp, POMCP):
+                    # takes snapshot of belief tree before it gets updated
+                    pomdp.stop_pondering()
+                    self.snapshot_tree(visualiser, pomdp.tree, '{}.gv'.format(i))
             
-            # update states
-            belief = pomdp.update_belief(belief, action, obs)
-            total_rewards += reward
-            budget -= cost
-
-            # print ino
-            log.info('\n'.join([
-              'Taking action: {}'.format(action),
-              'Observation: {}'.format(obs),
-              'Reward: {}'.format(reward),
-              'Budget: {}'.format(budget),
-              'New state: {}'.format(new_state),
-              'New Belief: {}'.format(belief),
-              '=' * 20
-            ]))
-
-            if budget <= 0:
-                log.info('Budget spent.')
+                # update states
+                belief = pomdp.update_belief(belief, action, obs)
+                total_rewards += reward
+                budget -= cost
+
+                # print ino
+                log.info('\n'.join([
+                  'Taking action: {}'.format(action),
+                  'Observation: {}'.format(obs),
+                  'Reward: {}'.format(reward),
+                  'Budget: {}'.format(budget),
+                  'New state: {}'.format(new_state),
+                  'New Belief: {}'.format(belief),
+                  '=' * 20
+                ]))
+
+                if budget <= 0:
+                    log.info('Budget spent.')
+        finally:
+            # stops the solver's worker processes, if any
+            pomdp.close()
 
 
         log.info('{} games played. Total reward = {}'.format(i + 1, total_rewards))
@@ -113,20 +165,35 @@ class PomdpRunner:
         total_rewards, budget = 0, params.budget
 
         log.info('~~~ initialising ~~~')
-        with PomdpParser(params.env_config) as ctx:
+        with self.create_parser() as ctx:
             # creates model and solver
-            model = self.create_model(ctx.copy_env())
+            model = self.create_model(self.load_env(ctx))
             pomdp = self.create_solver(algo, model)
 
             # supply additional algo params
             belief = ctx.random_beliefs() if params.random_prior else ctx.generate_beliefs()
 
-            if algo == 'pbvi':
+            if isinstance(pomdp, QMDP):
+                pomdp.add_configs(epsilon=kwargs.get('epsilon', 1e-6))
+                pomdp.solve(T)
+
+            elif isinstance(pomdp, HSVI):
+                # HSVI explores the beliefs reachable from the initial one by itself
+                pomdp.add_configs(belief, epsilon=kwargs.get('epsilon', 0.01), lp_prune=kwargs.get('lp_prune', False))
+                pomdp.solve(T)
+
+            elif isinstance(pomdp, PBVI):
                 #belief_points = ctx.generate_belief_points(kwargs['stepsize'])                
-                belief_points = pomdp.generate_reachable_belief_points(belief, kwargs['Bsize'])
+                belief_points = pomdp.generate_reachable_belief_points(belief, kwargs['Bsize'],
+                                                                       expansion=kwargs.get('expansion', 'random'),
+                                                                       min_distance=kwargs.get('min_distance', 0.0))
                 #belief_points = pomdp.generate_reachable_belief_points(belief, 500)
                 print('Belief points generated: ', len(belief_points))
-                pomdp.add_configs(belief_points)
+                pomdp.add_configs(belief_points, lp_prune=kwargs.get('lp_prune', False), epsilon=kwargs.get('epsilon'),
+                                  error_bound=kwargs.get('error_bound', False), init=kwargs.get('init', 'zero'),
+                                  num_workers=kwargs.get('num_workers', 1),
+                                  warm_start=kwargs.get('warm_start'),
+                                  warm_start_lower_bound=kwargs.get('warm_start_lower_bound', False))
                 pomdp.solve(T)
 
             elif algo == 'pomcp':
@@ -141,34 +208,38 @@ class PomdpRunner:
                 Max Play: {}
                 ++++++++++++++++++++++'''.format(model.curr_state, budget, belief, T, params.max_play))
 
-                for i in range(params.max_play):
-                  # plan, take action and receive environment feedbacks
-                    pomdp.solve(T)
-                    action = pomdp.get_action(belief)
-                    new_state, obs, reward, cost = pomdp.take_action(action)
+                try:
+                    for i in range(params.max_play):
+                      # plan, take action and receive environment feedbacks
+                        pomdp.solve(T)
+                        action = pomdp.get_action(belief)
+                        new_state, obs, reward, cost = pomdp.take_action(action)
                     
-                    if params.snapshot and isinstance(pomdp, POMCP):
-                        # takes snapshot of belief tree before it gets updated
-                        self.snapshot_tree(visualiser, pomdp.tree, '{}.gv'.format(i))
+                        if params.snapshot and isinstance(pomdp, POMCP):
+                            # takes snapshot of belief tree before it gets updated
+                            self.snapshot_tree(visualiser, pomdp.tree, '{}.gv'.format(i))
             
-                    # update states
-                    belief = pomdp.update_belief(belief, action, obs)
-                    total_rewards += reward
-                    budget -= cost
+                        # update states
+                        belief = pomdp.update_belief(belief, action, obs)
+                        total_rewards += reward
+                        budget -= cost
                  
-                    # print ino
-                    log.info('\n'.join([
-                     'Taking action: {}'.format(action),
-                     'Observation: {}'.format(obs),
-                     'Reward: {}'.format(reward),
-                     'Budget: {}'.format(budget),
-                     'New state: {}'.format(new_state),
-                     'New Belief: {}'.format(belief),
-                     '=' * 20
-                    ]))
+                        # print ino
+                        log.info('\n'.join([
+                         'Taking action: {}'.format(action),
+                         'Observation: {}'.format(obs),
+                         'Reward: {}'.format(reward),
+                         'Budget: {}'.format(budget),
+                         'New state: {}'.format(new_state),
+                         'New Belief: {}'.format(belief),
+                         '=' * 20
+                        ]))
                   
-                    if budget <= 0:
-                        log.info('Budget spent.')
+                        if budget <= 0:
+                            log.info('Budget spent.')
+                finally:
+                    # stops the solver's worker processes, if any
+                    pomdp.close()
                 log.info('{} games played. Total reward = {}'.format(i + 1, total_rewards))
         return pomdp
 
@@ -178,19 +249,19 @@ class PomdpRunner:
         total_rewards, budget = 0, params.budget
 
         log.info('~~~ initialising simulations ~~~')
-        with PomdpParser(params.env_config) as ctx:
+        with self.create_parser() as ctx:
             total_rewards_simulations = []
             for simulation in range(params.sim):                
                 log.info('~~~ initialising simulation: ' + str(simulation) + '~~~' )
             
                 # creates model and solver
-                model = self.create_model(ctx.copy_env())
+                model = self.create_model(self.load_env(ctx))
                 pomdp = self.create_solver(algo, model)
     
                 # supply additional algo params
                 belief = ctx.random_beliefs() if params.random_prior else ctx.generate_beliefs()
     
-                if algo == 'pbvi':
+                if isinstance(pomdp, PBVI):
                     # charging alphavec policy file
                     # belief_points = pomdp.generate_reachable_belief_points(belief, 50)
                     # pomdp.add_configs(belief_points)
@@ -209,40 +280,44 @@ class PomdpRunner:
                 Max Play: {}
                 ++++++++++++++++++++++'''.format(model.curr_state, belief, params.max_play))
 
-                for i in range(params.max_play):
-                    # plan, take action and receive environment feedbacks
-                    if algo == 'pomcp':
-                        pomdp.solve(T)
+                try:
+                    for i in range(params.max_play):
+                        # plan, take action and receive environment feedbacks
+                        if algo == 'pomcp':
+                            pomdp.solve(T)
                         
-                    if params.random_policy :
-                        action = random.choice(pomdp.model.actions)
-                    else:
-                        action = pomdp.get_action(belief)
+                        if params.random_policy :
+                            action = random.choice(pomdp.model.actions)
+                        else:
+                            action = pomdp.get_action(belief)
                     
-                    new_state, obs, reward, cost = pomdp.take_action(action)
+                        new_state, obs, reward, cost = pomdp.take_action(action)
                     
-                    if params.snapshot and isinstance(pomdp, POMCP):
-                        # takes snapshot of belief tree before it gets updated
-                        self.snapshot_tree(visualiser, pomdp.tree, '{}.gv'.format(i))
+                        if params.snapshot and isinstance(pomdp, POMCP):
+                            # takes snapshot of belief tree before it gets updated
+                            self.snapshot_tree(visualiser, pomdp.tree, '{}.gv'.format(i))
             
-                    # update states
-                    belief = pomdp.update_belief(belief, action, obs)
-                    total_rewards += reward
-                    budget -= cost
+                        # update states
+                        belief = pomdp.update_belief(belief, action, obs)
+                        total_rewards += reward
+                        budget -= cost
                  
-                    # print ino
-                    log.info('\n'.join([
-                     'Taking action: {}'.format(action),
-                     'Observation: {}'.format(obs),
-                     'Reward: {}'.format(reward),
-                     'Budget: {}'.format(budget),
-                     'New state: {}'.format(new_state),
-                     'New Belief: {}'.format(belief),
-                     '=' * 20
-                    ]))
+                        # print ino
+                        log.info('\n'.join([
+                         'Taking action: {}'.format(action),
+                         'Observation: {}'.format(obs),
+                         'Reward: {}'.format(reward),
+                         'Budget: {}'.format(budget),
+                         'New state: {}'.format(new_state),
+                         'New Belief: {}'.format(belief),
+                         '=' * 20
+                        ]))
                   
-                    if budget <= 0:
-                        log.info('Budget spent.')
+                        if budget <= 0:
+                            log.info('Budget spent.')
+                finally:
+                    # stops the solver's worker processes, if any
+                    pomdp.close()
                 log.info('{} games played. Total reward = {}'.format(i + 1, total_rewards))
                 total_rewards_simulations.append(total_rewards) 
             
@@ -262,19 +337,19 @@ class PomdpRunner:
         total_rewards, budget = 0, params.budget
 
         log.info('~~~ initialising experience replay ~~~')
-        with PomdpParser(params.env_config) as ctx:
+        with self.create_parser() as ctx:
             total_rewards_simulations = []
             for simulation in range(params.sim):                
                 log.info('~~~ initialising simulation: ' + str(simulation) + '~~~' )
             
                 # creates model and solver
-                model = self.create_model(ctx.copy_env())
+                model = self.create_model(self.load_env(ctx))
                 pomdp = self.create_solver(algo, model)
     
                 # supply additional algo params
                 belief = ctx.random_beliefs() if params.random_prior else ctx.generate_beliefs()
     
-                if algo == 'pbvi':
+                if isinstance(pomdp, PBVI):
                     # charging alphavec policy file
                     # belief_points = pomdp.generate_reachable_belief_points(belief, 50)
                     # pomdp.add_configs(belief_points)
@@ -293,35 +368,39 @@ class PomdpRunner:
                 Max Play: {}
                 ++++++++++++++++++++++'''.format(model.curr_state, belief, params.max_play))
 
-                for i in range(params.max_play):
-                    # plan, take action and receive environment feedbacks
-                    if algo == 'pomcp':
-                        pomdp.solve(T)
-                    action = pomdp.get_action(belief)
-                    new_state, obs, reward, cost = pomdp.take_action(action)
+                try:
+                    for i in range(params.max_play):
+                        # plan, take action and receive environment feedbacks
+                        if algo == 'pomcp':
+                            pomdp.solve(T)
+                        action = pomdp.get_action(belief)
+                        new_state, obs, reward, cost = pomdp.take_action(action)
                     
-                    if params.snapshot and isinstance(pomdp, POMCP):
-                        # takes snapshot of belief tree before it gets updated
-                        self.snapshot_tree(visualiser, pomdp.tree, '{}.gv'.format(i))
+                        if params.snapshot and isinstance(pomdp, POMCP):
+                            # takes snapshot of belief tree before it gets updated
+                            self.snapshot_tree(visualiser, pomdp.tree, '{}.gv'.format(i))
             
-                    # update states
-                    belief = pomdp.update_belief(belief, action, obs)
-                    total_rewards += reward
-                    budget -= cost
+                        # update states
+                        belief = pomdp.update_belief(belief, action, obs)
+                        total_rewards += reward
+                        budget -= cost
                  
-                    # print ino
-                    log.info('\n'.join([
-                     'Taking action: {}'.format(action),
-                     'Observation: {}'.format(obs),
-                     'Reward: {}'.format(reward),
-                     'Budget: {}'.format(budget),
-                     'New state: {}'.format(new_state),
-                     'New Belief: {}'.format(belief),
-                     '=' * 20
-                    ]))
+                        # print ino
+                        log.info('\n'.join([
+                         'Taking action: {}'.format(action),
+                         'Observation: {}'.format(obs),
+                         'Reward: {}'.format(reward),
+                         'Budget: {}'.format(budget),
+                         'New state: {}'.format(new_state),
+                         'New Belief: {}'.format(belief),
+                         '=' * 20
+                        ]))
                   
-                    if budget <= 0:
-                        log.info('Budget spent.')
+                        if budget <= 0:
+                            log.info('Budget spent.')
+                finally:
+                    # stops the solver's worker processes, if any
+                    pomdp.close()
                 log.info('{} games played. Total reward = {}'.format(i + 1, total_rewards))
                 total_rewards_simulations.append(total_rewards) 
             
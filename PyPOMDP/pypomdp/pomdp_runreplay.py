@@ -1,9 +1,9 @@
 import os
 import numpy as np
 import pandas as pd
-from models import RockSampleModel, Model
-from solvers import POMCP, PBVI
-from parsers import PomdpParser, GraphViz
+from models import RockSampleModel, Model, CompiledModel, SparseModel, FactoredModel
+from solvers import POMCP, PBVI, Perseus, HSVI, QMDP, FIB
+from parsers import PomdpParser, PomdpxParser, GraphViz
 from logger import Logger as log
 from belief_update_animation import AnimateBeliefPlot
 
@@ -60,10 +60,41 @@ class PomdpRunReplay:
         :param env_configs: the complete encapsulation of environment's dynamics
         :return: concrete model
         """
-        MODELS = {
-            'RockSample': RockSampleModel,
+        if env_configs.get('factored'):
+            # POMDPX models are sampled variable by variable, whatever the backend
+            FACTORED_MODELS = {
+                'RockSample': RockSampleModel,
+            }
+            return FACTORED_MODELS.get(env_configs['model_name'], FactoredModel)(env_configs)
+
+        BACKENDS = {
+            'dense': CompiledModel,
+            'sparse': SparseModel,
         }
-        return MODELS.get(env_configs['model_name'], Model)(env_configs)
+        if self.params.backend in BACKENDS:
+            return BACKENDS[self.params.backend](env_configs)
+        return Model(env_configs)
+
+    def create_parser(self):
+        """
+        The dict backend needs the entries keyed by names; every other backend gets them compiled to integer ids,
+        cached on disk between runs. POMDPX files are always read into factored tables
+        """
+        if self.params.env_config.endswith('.pomdpx'):
+            return PomdpxParser(self.params.env_config)
+        if self.params.backend == 'dict':
+            return PomdpParser(self.params.env_config)
+        return PomdpParser(self.params.env_config, compiled=True, cache_dir=self.params.cache_folder)
+
+    def load_env(self, ctx):
+        """
+        Copies the parsed environment in the layout expected by the chosen model backend
+        :param ctx: PomdpParser context
+        :return: environment configs for create_model
+        """
+        if self.params.backend == 'sparse':
+            return ctx.copy_sparse_env()
+        return ctx.copy_env()
 
     def create_solver(self, algo, model):
         """
@@ -74,12 +105,16 @@ class PomdpRunReplay:
         """
         SOLVERS = {
             'pbvi': PBVI,
+            'perseus': Perseus,
+            'hsvi': HSVI,
+            'qmdp': QMDP,
+            'fib': FIB,
             'pomcp': POMCP,
         }
         return SOLVERS.get(algo)(model)
 
     def snapshot_tree(self, visualiser, tree, filename):
-        visualiser.update(tree.root)
+        visualiser.update(tree)
         visualiser.render('./dev/snapshots/{}'.format(filename))  # TODO: parametrise the dev folder path
 
     def replay(self, algo, T, **kwargs):
@@ -89,19 +124,19 @@ class PomdpRunReplay:
 
         log.info('~~~ initialising experience replay ~~~')
         ## 4 experiences 
-        with PomdpParser(params.env_config) as ctx:
+        with self.create_parser() as ctx:
 
             for simulation in range(4):                
                 log.info('~~~ initialising simulation: ' + str(simulation) + '~~~' )
             
                 # creates model and solver
-                model = self.create_model(ctx.copy_env())
+                model = self.create_model(self.load_env(ctx))
                 pomdp = self.create_solver(algo, model)
     
                 # supply additional algo params
                 belief = ctx.random_beliefs() if params.random_prior else ctx.generate_beliefs()
     
-                if algo == 'pbvi':
+                if isinstance(pomdp, PBVI):
                     # charging alphavec policy file
                     # belief_points = pomdp.generate_reachable_belief_points(belief, 50)
                     # pomdp.add_configs(belief_points)
@@ -141,6 +176,10 @@ class PomdpRunReplay:
                     if params.snapshot and isinstance(pomdp, POMCP):
                         # takes snapshot of belief tree before it gets updated
                         self.snapshot_tree(visualiser, pomdp.tree, '{}.gv'.format(i))
+
+                    if algo == 'pomcp':
+                        # keeps searching on the experiment's action while the observation is classified
+                        pomdp.start_pondering(exp_action, T)
                         
                     if i == 0:
                         plotting = AnimateBeliefPlot(belief,action,exp_action)
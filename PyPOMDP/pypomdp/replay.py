@@ -25,6 +25,8 @@ if __name__ == '__main__':
                         help='Whether or not to use a randomly generated distribution as prior belief, default to False')
     parser.add_argument('--max_play', type=int, default=100, help='Maximum number of play steps')
     parser.add_argument('--sim', type=int, default=100, help='Maximum number of simulations')
+    parser.add_argument('--backend', type=str, default='dict',
+                        help='model backend: dict - parsed dicts keyed by names; dense - compiled NumPy arrays; sparse - CSR matrices of nonzero entries')
     parser.add_argument('--policyfile', type=str, default='alphavecfile.policy', help='alphaVec policy file')
     parser.add_argument('--option', type=str, default='onsolve', 
                         help='please choose between : onsolve - for online solving; offsolve - for offline solving; simulate - for simulating a policyfile; replay - for a experience replay')
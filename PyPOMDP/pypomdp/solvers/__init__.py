@@ -1,3 +1,6 @@
 from .solver import Solver
 from .pbvi import PBVI
+from .perseus import Perseus
+from .hsvi import HSVI
+from .qmdp import QMDP, FIB
 from .pomcp import POMCP
\ No newline at end of file
@@ -0,0 +1,152 @@
+import numpy as np
+import time
+
+from solvers.pbvi import PBVI
+from util.alpha_vector import AlphaVector, prune
+from logger import Logger as log
+
+
+class HSVI(PBVI):
+    """
+    Heuristic search value iteration (Smith & Simmons, 2004). The optimal value function is kept between a lower
+    bound, the alpha vectors of the policy, and a sawtooth upper bound over a set of (belief, value) points. Every
+    trial goes down from the initial belief, following the action with the best upper bound and the observation
+    with the largest weighted gap, then backs up both bounds on the way back up. Solving stops once the gap at the
+    initial belief is below epsilon, so only the beliefs that matter for it are ever backed up
+    """
+    def __init__(self, model):
+        PBVI.__init__(self, model)
+        self.b0 = None
+        self.alphas = None
+        self.actions = None
+        self.dynamics = None
+        self.corners = None
+        self.ub_points = None
+        self.ub_values = None
+
+    def add_configs(self, initial_belief, epsilon=0.01, lp_prune=False, max_iterations=1000):
+        """
+        :param initial_belief: belief the bounds are tightened at
+        :param epsilon: target gap between the upper and lower bounds at the initial belief
+        :param lp_prune: see PBVI.add_configs
+        :param max_iterations: value iterations of the fast informed bound the corners of the upper bound start from
+        """
+        PBVI.add_configs(self, [list(initial_belief)], lp_prune=lp_prune, epsilon=epsilon)
+        m, S = self.model, self.model.num_states
+        self.b0 = np.asarray(initial_belief, dtype=float)
+
+        lower = self.lower_bound_alpha()
+        self.alphas, self.actions = np.array([lower.v]), np.array([m.action_ids[lower.action]])
+
+        # dynamics[a, o] maps b to the unnormalised next belief b'(sj) = Z(a, sj, o) * sum_i T(a, si, sj) * b(si)
+        self.dynamics = self.compute_gammas(np.eye(S)) / m.discount
+
+        # upper bound: fast informed bound at the corners of the simplex, and the points added since
+        self.corners = self.fib_alphas(max_iterations)[0].max(axis=0)
+        self.ub_points, self.ub_values = np.empty((0, S)), np.empty(0)
+
+    def lower_bound(self, beliefs):
+        return np.max(np.dot(np.atleast_2d(beliefs), self.alphas.T), axis=1)
+
+    def __sawtooth(self, beliefs, points, values):
+        """
+        :return: (K, N) bounds at every belief given by the corners and each (point, value) alone: the corner
+            interpolation lowered by the point's drop below it, times min_s b(s) / b_i(s)
+        """
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratios = np.where(points[None] > 0, beliefs[:, None, :] / points[None], np.inf).min(axis=2)
+        drops = values - np.dot(points, self.corners)
+        return np.dot(beliefs, self.corners)[:, None] + ratios * drops
+
+    def upper_bound(self, beliefs):
+        beliefs = np.atleast_2d(beliefs)
+        values = np.dot(beliefs, self.corners)
+        if not len(self.ub_points):
+            return values
+        return np.minimum(values, self.__sawtooth(beliefs, self.ub_points, self.ub_values).min(axis=1))
+
+    def gap(self, belief):
+        return float(self.upper_bound(belief)[0] - self.lower_bound(belief)[0])
+
+    def __lookahead(self, belief):
+        """
+        :return: next beliefs (A, O, S), their probabilities P(o | b, a) (A, O) and the upper bound Q-values (A)
+        """
+        m = self.model
+        successors = np.dot(self.dynamics, belief)
+        probs = successors.sum(axis=2)
+        successors /= np.where(probs > 0, probs, 1.0)[:, :, None]
+
+        upper = self.upper_bound(successors.reshape(-1, m.num_states)).reshape(probs.shape)
+        q = np.dot(self.reward_matrix, belief) + m.discount * np.sum(probs * upper, axis=1)
+        return successors, probs, q
+
+    def __update(self, belief):
+        """
+        Point backup of both bounds at 'belief'
+        """
+        alpha, ai = self.backup(self.alphas, belief[None, :])
+        self.alphas = np.vstack([self.alphas, alpha])
+        self.actions = np.append(self.actions, ai)
+
+        _, _, q = self.__lookahead(belief)
+        value = q.max()
+        if value < self.upper_bound(belief)[0]:
+            # the points whose value the new one bounds at least as tightly are useless
+            keep = self.__sawtooth(self.ub_points, belief[None, :], np.array([value]))[:, 0] > self.ub_values
+            self.ub_points = np.vstack([self.ub_points[keep], belief])
+            self.ub_values = np.append(self.ub_values[keep], value)
+
+    def trial(self):
+        """
+        :return: number of beliefs backed up
+        """
+        discount, epsilon = self.model.discount, self.epsilon
+        belief, t, path = self.b0, 0, []
+        while self.gap(belief) > epsilon * discount ** -t:
+            path.append(belief)
+            successors, probs, q = self.__lookahead(belief)
+            ai = np.argmax(q)
+            gaps = self.upper_bound(successors[ai]) - self.lower_bound(successors[ai])
+            oi = np.argmax(probs[ai] * (gaps - epsilon * discount ** -(t + 1)))
+            belief, t = successors[ai, oi], t + 1
+
+        for belief in reversed(path):
+            self.__update(belief)
+        return len(path)
+
+    def solve(self, T):
+        """
+        Runs at most T trials, fewer once the gap at the initial belief is below epsilon. Every trial is recorded
+        in self.trace as (step, gap, number of alpha vectors, upper bound points, point backups, seconds)
+        """
+        if self.solved:
+            return
+
+        m = self.model
+        print("Trials for HSVI ", T)
+        self.trace, self.converged = [], False
+        for step in range(T):
+            start = time.time()
+            backups = self.trial()
+            keep = prune(self.alphas, lp=self.lp_prune)
+            self.alphas, self.actions = self.alphas[keep], self.actions[keep]
+
+            gap = self.gap(self.b0)
+            self.trace.append({'step': step + 1, 'gap': gap, 'alphas': len(self.alphas),
+                               'upper_points': len(self.ub_points), 'backups': backups, 'time': time.time() - start})
+            log.info('HSVI trial {}: {} alpha vectors, {} upper bound points, {} backups, gap = {}'.format(
+                step + 1, len(self.alphas), len(self.ub_points), backups, gap))
+
+            if gap < self.epsilon:
+                self.converged = True
+                log.info('HSVI converged after {} trials'.format(step + 1))
+                break
+
+        self.alpha_vecs = [AlphaVector(a=m.actions[ai], v=v) for ai, v in zip(self.actions, self.alphas)]
+        self.belief_points = [self.b0.tolist()] + self.ub_points.tolist()
+        self.solved = True
+        self.saving_policy()
+
+    def stopping_threshold(self):
+        return self.epsilon
@@ -1,11 +1,18 @@
 import numpy as np
+import hashlib
 import json
+import os
+import time
+import multiprocessing as mp
 
 from solvers import Solver
-from util.alpha_vector import AlphaVector
+from models.model import Model
+from util.alpha_vector import AlphaVector, prune
 from util.json_encoder import toJSON
-from util.helper import rand_choice, randint, round
+from util.helper import rand_choice, randint, round, cdf_tables, draw_cdf
+from util.belief_set import BeliefSet
 from array import array
+from logger import Logger as log
 
 MIN = -np.inf
 
@@ -15,12 +22,53 @@ class PBVI(Solver):
         self.belief_points = None
         self.alpha_vecs = None
         self.solved = False
+        self.projections = None
+        self.lp_prune = False
+        self.epsilon = None
+        self.error_bound = False
+        self.trace = []
+        self.converged = False
+        self.num_workers = 1
+        self.workers = []    # pipes to the parallel backup processes
+        self.shared = {}     # shared memory blocks of the parallel backups: name => (SharedMemory, array view)
 
-    def add_configs(self, belief_points):
+    def add_configs(self, belief_points, lp_prune=False, epsilon=None, error_bound=False, init='zero',
+                    num_workers=1, warm_start=None, warm_start_lower_bound=False):
+        """
+        :param belief_points: beliefs the value function is backed up at
+        :param lp_prune: also drop, after every backup, the alpha vectors that are not the best one at any belief
+            (one linear program per vector, needs scipy); duplicates and pointwise-dominated vectors always go
+        :param epsilon: solve stops once a backup changes the value of no belief point by epsilon or more;
+            None to always run T backups
+        :param error_bound: read epsilon as a bound on the distance to the optimal value function instead, i.e. stop
+            once the Bellman residual is below epsilon * (1 - discount) / discount
+        :param init: value function the backups start from: 'zero', or the 'qmdp' or 'fib' upper bound
+        :param num_workers: number of processes backing up slices of the belief points, this one included
+        :param warm_start: policy file of a previous solve to start from instead of init (see resume_policy)
+        :param warm_start_lower_bound: when that file was solved for another model, lower its alpha vectors under the
+            new optimal value function; otherwise they are taken as they are and may overestimate it
+        """
         Solver.add_configs(self)
         self.alpha_vecs = [AlphaVector(a=-1, v=np.zeros(self.model.num_states))] # filled with a dummy alpha vector
         self.belief_points = belief_points
+        self.lp_prune = lp_prune
+        self.epsilon = epsilon
+        self.error_bound = error_bound
+        self.num_workers = num_workers
+        if num_workers > 1:
+            try:
+                from multiprocessing import shared_memory
+            except ImportError:
+                # Python < 3.8
+                log.warning('Parallel backups need multiprocessing.shared_memory, backing up on one process')
+                self.num_workers = 1
         self.compute_gamma_reward()
+        self.compute_projections()
+        if init in ('qmdp', 'fib'):
+            alphas, _ = self.mdp_alphas() if init == 'qmdp' else self.fib_alphas()
+            self.alpha_vecs = [AlphaVector(a=a, v=v) for a, v in zip(self.model.actions, alphas)]
+        if warm_start is not None:
+            self.resume_policy(warm_start, lower_bound=warm_start_lower_bound)
 
     def compute_gamma_reward(self):
         """
@@ -31,76 +79,235 @@ class PBVI(Solver):
             a: np.frombuffer(array('d', [self.model.reward_function(a, s) for s in self.model.states]))
             for a in self.model.actions
         }
+        self.reward_matrix = np.array([self.gamma_reward[a] for a in self.model.actions])
+
+    def lower_bound_alpha(self):
+        """
+        :return: the alpha vector min R(s, a) / (1 - discount) everywhere, a lower bound of the optimal value function
+        """
+        m = self.model
+        ai, _ = np.unravel_index(np.argmin(self.reward_matrix), self.reward_matrix.shape)
+        worst = self.reward_matrix.min() / (1.0 - m.discount)
+        return AlphaVector(a=m.actions[ai], v=np.full(m.num_states, worst))
 
-    def compute_gamma_action_obs(self, a, o):
+    def compute_projections(self):
+        """
+        Precomputes M[a, o] = discount * T[a] * diag(Z[a, :, o]) once, when the model can hold it densely
+        """
+        self.projections = self.model.projection_matrices()
+
+    def compute_gamma_action_obs(self, ai, oi, alphas):
         """
         Computes a set of vectors, one for each previous alpha
         vector that represents the update to that alpha vector
         given an action and observation
 
-        :param a: action index
-        :param o: observation index
+        :param ai: action index
+        :param oi: observation index
+        :param alphas: (G, S) matrix of the previous alpha vectors
+        """
+        if self.projections is None:
+            return self.model.project(ai, oi, alphas)
+        return np.dot(alphas, self.projections[ai, oi].T)
+
+    def compute_gammas(self, alphas):
+        """
+        :param alphas: (G, S) matrix of the previous alpha vectors
+        :return: (A, O, G, S) array of the projections of every alpha vector for every action and observation
         """
         m = self.model
+        if self.projections is not None:
+            return np.matmul(alphas, self.projections.transpose(0, 1, 3, 2))
+        return np.array([[self.compute_gamma_action_obs(ai, oi, alphas) for oi in range(len(m.observations))]
+                         for ai in range(len(m.actions))])
+
+    def backup(self, alphas, beliefs=None, gammas=None):
+        """
+        Point-based backup of the alpha vectors over many belief points at once
+        :param alphas: (G, S) matrix of the previous alpha vectors
+        :param beliefs: (B, S) matrix of the beliefs to back up, the belief points by default
+        :param gammas: projections of the alpha vectors, when already computed by compute_gammas
+        :return: (B, S) matrix of the new alpha vectors, one per belief, and their action indices
+        """
+        B = np.asarray(self.belief_points if beliefs is None else beliefs, dtype=float)
+        if gammas is None:
+            gammas = self.compute_gammas(alphas)
+        return point_backup(B, gammas, self.reward_matrix)
+
+    def __iterate(self, update, alphas, max_iterations, epsilon):
+        """
+        Applies 'update' to one alpha vector per action until no entry changes by epsilon or more
+        :return: the (A, S) alpha vectors and the trace of the iterations
+        """
+        trace = []
+        for step in range(max_iterations):
+            start = time.time()
+            new_alphas = update(alphas)
+            residual = float(np.max(np.abs(new_alphas - alphas)))
+            alphas = new_alphas
+            trace.append({'step': step + 1, 'residual': residual, 'alphas': len(alphas), 'time': time.time() - start})
+            if residual < epsilon:
+                break
+        return alphas, trace
+
+    def mdp_alphas(self, max_iterations=1000, epsilon=1e-6):
+        """
+        QMDP upper bound: the Q-values of the fully observable MDP, Q(s, a) = R(s, a) + discount * T[a] max_a' Q(., a')
+        :return: (A, S) alpha vectors, one per action, and the trace of the value iterations
+        """
+        m = self.model
+
+        def update(Q):
+            return self.reward_matrix + m.discount * m.expected_values(Q.max(axis=0))
+        return self.__iterate(update, self.reward_matrix, max_iterations, epsilon)
+
+    def fib_alphas(self, max_iterations=1000, epsilon=1e-6):
+        """
+        Fast informed bound (Hauskrecht, 2000), tighter than QMDP as the observation is known before the next action:
+            alpha_a(s) = R(s, a) + sum_o max_a' discount * sum_j T(a, s, sj) * Z(a, sj, o) * alpha_a'(sj)
+        :return: (A, S) alpha vectors, one per action, and the trace of the value iterations
+        """
+        if self.projections is None and type(self.model).project is Model.project:
+            # A * O loops over S * S transition_function calls for every iteration
+            raise ValueError('The fast informed bound needs a model with dense or sparse projections')
+
+        def update(alphas):
+            return self.reward_matrix + self.compute_gammas(alphas).max(axis=2).sum(axis=1)
+        # starting from QMDP, the iterations only go down
+        return self.__iterate(update, self.mdp_alphas(max_iterations, epsilon)[0], max_iterations, epsilon)
+
+    def stopping_threshold(self):
+        """
+        :return: Bellman residual under which solve stops, None when it never stops early
+        """
+        if self.epsilon is None:
+            return None
+        if self.error_bound:
+            # a residual r keeps the value function within r * discount / (1 - discount) of the optimal one
+            discount = self.model.discount
+            return self.epsilon * (1.0 - discount) / discount if discount < 1.0 else 0.0
+        return self.epsilon
+
+    def improve(self, alphas, actions, values):
+        """
+        One value iteration step: backs up every belief point
+        :param alphas: (G, S) matrix of the current alpha vectors
+        :param actions: their action indices
+        :param values: current value of every belief point
+        :return: the new alpha vectors, their action indices and the number of point backups done
+        """
+        if self.num_workers > 1:
+            return self.__parallel_backup(alphas)
+        alphas, actions = self.backup(alphas)
+        return alphas, actions, len(alphas)
+
+    def __share(self, key, shape, dtype=np.float64):
+        """
+        Allocates a shared memory block for the workers, replacing the previous one of the same name
+        :return: the array view of the block
+        """
+        from multiprocessing import shared_memory
+        self.__release(key)
+        size = max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1)
+        shm = shared_memory.SharedMemory(create=True, size=size)
+        self.shared[key] = (shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf))
+        return self.shared[key][1]
+
+    def __release(self, key):
+        if key in self.shared:
+            shm, _ = self.shared.pop(key)
+            shm.close()
+            shm.unlink()
+
+    def __specs(self):
+        return {key: (shm.name, array.shape, array.dtype.str) for key, (shm, array) in self.shared.items()}
+
+    def __parallel_backup(self, alphas):
+        """
+        Backs up the belief points split in num_workers slices. The belief points, the projections of the alpha
+        vectors and the results live in shared memory, so only slice bounds go through the pipes; the belief
+        points are copied once and the projections once per step
+        """
+        m, B = self.model, np.asarray(self.belief_points, dtype=float)
+        gammas = self.compute_gammas(alphas)
+        G = gammas.shape[2]
 
-        gamma_action_obs = []
-        for alpha in self.alpha_vecs:
-            v = np.zeros(m.num_states)  # initialize the update vector [0, ... 0]
-            for i, si in enumerate(m.states):
-                for j, sj in enumerate(m.states):
-                    v[i] += m.transition_function(a, si, sj) * \
-                        m.observation_function(a, sj, o) * \
-                        alpha.v[j]
-                v[i] *= m.discount
-            gamma_action_obs.append(v)
-        return gamma_action_obs
+        resized = 'gammas' not in self.shared or self.shared['gammas'][1].shape[2] < G
+        if resized:
+            self.__share('gammas', gammas.shape[:2] + (max(G, len(B)), m.num_states))
+        if not self.workers:
+            self.__share('beliefs', B.shape)[:] = B
+            self.__share('alphas', B.shape)
+            self.__share('actions', (len(B),), np.int64)
+            for _ in range(self.num_workers - 1):
+                conn, worker_conn = mp.Pipe()
+                mp.Process(target=backup_worker, args=(worker_conn, self.reward_matrix, self.__specs()),
+                           daemon=True).start()
+                self.workers.append(conn)
+        elif resized:
+            for conn in self.workers:
+                conn.send(('attach', self.__specs()))
+        self.shared['gammas'][1][:, :, :G] = gammas
+
+        bounds = np.linspace(0, len(B), self.num_workers + 1).astype(int)
+        for conn, start, end in zip(self.workers, bounds[1:-1], bounds[2:]):
+            conn.send(('backup', G, start, end))
+        new_alphas, new_actions = self.shared['alphas'][1], self.shared['actions'][1]
+        new_alphas[:bounds[1]], new_actions[:bounds[1]] = point_backup(B[:bounds[1]], gammas, self.reward_matrix)
+        for conn in self.workers:
+            conn.recv()
+        return new_alphas.copy(), new_actions.copy(), len(B)
+
+    def close(self):
+        """
+        Stops the parallel backup workers and frees the shared memory
+        """
+        for conn in self.workers:
+            conn.send(('close',))
+        self.workers = []
+        for key in list(self.shared):
+            self.__release(key)
 
     def solve(self, T):
+        """
+        Runs at most T value iteration steps, fewer when the value function has converged (see add_configs). Every
+        step is recorded in self.trace as (step, residual, number of alpha vectors, point backups, seconds)
+        """
         if self.solved:
             return
 
-        m = self.model
-        print("Steps for PBVI ",T)
-        for step in range(T):
-            #print("Step ", step)
-            # First compute a set of updated vectors for every action/observation pair
-            # Action(a) => Observation(o) => UpdateOfAlphaVector (a, o)
-            gamma_intermediate = {
-                a: {
-                    o: self.compute_gamma_action_obs(a, o)
-                    for o in m.observations
-                } for a in m.actions
-            }
-
-            # Now compute the cross sum
-            gamma_action_belief = {}
-            for a in m.actions:
-
-                gamma_action_belief[a] = {}
-                for bidx, b in enumerate(self.belief_points):
-
-                    gamma_action_belief[a][bidx] = self.gamma_reward[a].copy()
-
-                    for o in m.observations:
-                        # only consider the best point
-                        best_alpha_idx = np.argmax(np.dot(gamma_intermediate[a][o], b))
-                        gamma_action_belief[a][bidx] += gamma_intermediate[a][o][best_alpha_idx]
-
-            # Finally compute the new(best) alpha vector set
-            self.alpha_vecs, max_val = [], MIN
-
-            for bidx, b in enumerate(self.belief_points):
-                best_av, best_aa = None, None
-
-                for a in m.actions:
-                    val = np.dot(gamma_action_belief[a][bidx], b)
-                    if best_av is None or val > max_val:
-                        max_val = val
-                        best_av = gamma_action_belief[a][bidx].copy()
-                        best_aa = a
-
-                self.alpha_vecs.append(AlphaVector(a=best_aa, v=best_av))
+        m, name = self.model, type(self).__name__
+        print("Steps for {} ".format(name), T)
+        B = np.asarray(self.belief_points, dtype=float)
+        alphas = np.array([alpha.v for alpha in self.alpha_vecs])
+        actions = np.array([m.action_ids.get(alpha.action, -1) for alpha in self.alpha_vecs])
+        values = np.max(np.dot(B, alphas.T), axis=1)
+        threshold = self.stopping_threshold()
+        self.trace, self.converged = [], False
+        try:
+            for step in range(T):
+                start = time.time()
+                alphas, actions, backups = self.improve(alphas, actions, values)
+                keep = prune(alphas, lp=self.lp_prune)
+                alphas, actions = alphas[keep], actions[keep]
+
+                # Bellman residual over the belief points
+                new_values = np.max(np.dot(B, alphas.T), axis=1)
+                residual = float(np.max(np.abs(new_values - values)))
+                values = new_values
+                self.trace.append({'step': step + 1, 'residual': residual, 'alphas': len(alphas), 'backups': backups,
+                                   'time': time.time() - start})
+                log.info('{} step {}: {} alpha vectors, {} backups, residual = {}'.format(
+                    name, step + 1, len(alphas), backups, residual))
 
+                if threshold is not None and residual < threshold:
+                    self.converged = True
+                    log.info('{} converged after {} steps'.format(name, step + 1))
+                    break
+        finally:
+            self.close()
+
+        self.alpha_vecs = [AlphaVector(a=m.actions[ai], v=v) for ai, v in zip(actions, alphas)]
         self.solved = True
         # print(self.alpha_vecs)
         self.saving_policy()
@@ -119,57 +326,208 @@ class PBVI(Solver):
     
     def update_belief(self, belief, action, obs):
         m = self.model
+        b_new = m.next_belief(np.asarray(belief, dtype=float), m.action_ids[action], m.observation_ids[obs])
+        return b_new.tolist()
+
+    def generate_reachable_belief_points(self, belief, max_belief_points, expansion='random', min_distance=0.0,
+                                         walkers=64, restart=20, patience=200):
+        """
+        Collects up to max_belief_points beliefs reachable from 'belief' in a BeliefSet, which drops the duplicates
+        and the beliefs closer than min_distance (L1) to the ones already collected
+        :param expansion: 'random' runs random walks from 'belief', one step of all the walkers at a time; 'ssea'
+            grows the set by stochastic simulation with exploratory actions: every point simulates one step of every
+            action and keeps the successor farthest from the set, which spreads the points over the simplex
+        :param walkers: number of random walks run side by side
+        :param restart: a walker that has not found a new belief for this many steps starts again from 'belief'
+        :param patience: the walks stop after this many steps without any new belief, when the reachable beliefs
+            are exhausted (at min_distance) before max_belief_points
+        :return: list of beliefs, 'belief' first; a warning is logged when there are fewer than max_belief_points
+        """
+        m = self.model
+        points = BeliefSet(m.num_states, min_distance=min_distance)
+        points.add(np.asarray(belief, dtype=float))
+
+        if expansion == 'ssea':
+            while len(points) < max_belief_points:
+                B = points.points[:len(points)].copy()
+                A = len(m.actions)
+                successors = self.__successors(np.repeat(B, A, axis=0), np.tile(np.arange(A), len(B)))
+                distances = points.distances(successors).reshape(len(B), A)
+                farthest = successors.reshape(len(B), A, -1)[np.arange(len(B)), np.argmax(distances, axis=1)]
+                order = np.argsort(-distances.max(axis=1), kind='stable')
+                if not points.add(farthest[order]).any():
+                    break
+        else:
+            start = np.asarray(belief, dtype=float)
+            walks = np.tile(start, (walkers, 1))
+            stalled = np.zeros(walkers, dtype=int)    # steps since every walker last found a new belief
+            idle = 0                                  # steps since any walker did
+            while len(points) < max_belief_points and idle < patience:
+                walks = self.__successors(walks, np.random.randint(0, len(m.actions), walkers))
+                added = points.add(walks)
+                stalled = np.where(added, 0, stalled + 1)
+                idle = 0 if added.any() else idle + 1
+                walks[stalled >= restart] = start
+                stalled[stalled >= restart] = 0
+
+        if len(points) < max_belief_points:
+            log.warning('Only {} reachable belief points of the {} requested were found'.format(
+                len(points), max_belief_points))
+        return points.tolist()[:max_belief_points]
 
-        b_new = []
-        for sj in m.states:
-            # print("POMDP PBVI: ", action, obs)
-            p_o_prime = m.observation_function(action, sj, obs)
-            summation = 0.0
-            for i, si in enumerate(m.states):
-                p_s_prime = m.transition_function(action, si, sj)
-                summation += p_s_prime * float(belief[i])
-            b_new.append(p_o_prime * summation)
-
-        # normalize
-        total = sum(b_new)
-        return [x / total for x in b_new]
-
-    def generate_reachable_belief_points(self, belief, max_belief_points):
+    def __successors(self, beliefs, actions):
+        """
+        Samples one successor of every belief: a state from the belief, an observation after the action
+        """
         m = self.model
-        ntrials = 10
-        n_tentatives = 0
-        beliefs=[]
-        beliefs.append(belief.copy())
-        bel = belief.copy()        
-        while len(beliefs)<max_belief_points and n_tentatives < ntrials*100:
-            for n in range(ntrials):
-               si = rand_choice(m.states)
-               ai = rand_choice(m.get_legal_actions(si))
-               #print(si,ai)
-               sj, oj, r, cost = m.simulate_action(si, ai, debug=False)
-               new_bel = self.update_belief(bel, ai, oj)
-               #print(new_bel)
-               if new_bel not in beliefs:
-                   beliefs.append(new_bel.copy())
-               if len(beliefs) >= max_belief_points:
-                   break
-               bel = new_bel.copy()
-            n_tentatives = n_tentatives + 1
-            #print(n_tentatives)
-               
-        return beliefs
+        states = draw_cdf(cdf_tables(beliefs))
+        _, observations, _, _ = m.simulate_batch(states, actions)
+        return m.next_beliefs(beliefs, actions, observations)
 
     def saving_policy(self):
         encoder = toJSON("alphavecfile.policy",self.alpha_vecs)
         encoder.saving_belief_points(self.belief_points)
+        encoder.saving_metadata({
+            'steps': len(self.trace),
+            'converged': self.converged,
+            'epsilon': self.epsilon,
+            'threshold': self.stopping_threshold(),
+            'trace': self.trace,
+            'model_hash': self.model_hash(),
+        })
         encoder.write_json()
         
+    def model_hash(self):
+        """
+        Fingerprint of the model a policy is solved for: names, discount, rewards, and the projections of a few fixed
+        random vectors through every (action, observation), which change with any entry of T or Z. Values are
+        rounded so that every backend gives the same hash
+        """
+        m = self.model
+        digest = hashlib.sha1(json.dumps([[str(s) for s in m.states], [str(a) for a in m.actions],
+                                          [str(o) for o in m.observations], float(m.discount)]).encode())
+        probe = np.random.RandomState(0).rand(4, m.num_states)
+        for array in (self.reward_matrix, self.compute_gammas(probe)):
+            digest.update((np.round(array, 9) + 0.0).tobytes())
+        return digest.hexdigest()
+
+    def resume_policy(self, policy_file, lower_bound=False):
+        """
+        Starts the backups from the alpha vectors of a previous policy file, and adds its belief points to the ones
+        backed up. The vectors of the wrong size or with an unknown action are dropped. When the file was solved for
+        another model (or has no model hash), the Bellman error of the vectors on the belief points is checked
+        :param lower_bound: also lower the vectors by max(V - HV) / (1 - discount) over the belief points in that
+            case, so that V <= HV holds there again and the backups start under the new optimal value function
+        :return: False when the file has no usable alpha vector, the backups then start from init
+        """
+        m, S = self.model, self.model.num_states
+        if not os.path.exists(policy_file):
+            log.warning('No policy file {} to warm start from'.format(policy_file))
+            return False
+        with open(policy_file) as f:
+            data = json.load(f)
+
+        alpha_vecs = [AlphaVector(a=alpha['action'], v=np.asarray(alpha['v'], dtype=float))
+                      for alpha in data['alphavec'] if alpha['action'] in m.action_ids and len(alpha['v']) == S]
+        if len(alpha_vecs) < len(data['alphavec']):
+            log.warning('{} alpha vectors of {} do not fit the model'.format(
+                len(data['alphavec']) - len(alpha_vecs), policy_file))
+        if not alpha_vecs:
+            return False
+
+        points = BeliefSet(S)
+        points.add(np.asarray(self.belief_points, dtype=float).reshape(-1, S))
+        beliefs = [b for b in data.get('beliefs') or [] if len(b) == S]
+        if beliefs:
+            points.add(np.asarray(beliefs, dtype=float))
+        self.belief_points = points.tolist()
+
+        alphas = np.array([alpha.v for alpha in alpha_vecs])
+        if data.get('metadata', {}).get('model_hash') != self.model_hash():
+            B = np.asarray(self.belief_points)
+            backed_up, _ = self.backup(alphas, B)
+            excess = np.max(np.dot(B, alphas.T), axis=1) - np.sum(backed_up * B, axis=1)
+            log.info('{} was solved for another model: Bellman error {}, overestimate {}'.format(
+                policy_file, float(np.abs(excess).max()), max(float(excess.max()), 0.0)))
+            if lower_bound and excess.max() > 0:
+                alphas = alphas - excess.max() / (1 - m.discount)
+
+        self.alpha_vecs = [AlphaVector(a=alpha.action, v=v) for alpha, v in zip(alpha_vecs, alphas)]
+        log.info('Warm start from {}: {} alpha vectors, {} belief points'.format(
+            policy_file, len(self.alpha_vecs), len(self.belief_points)))
+        return True
+
     def charging_policy(self,policy_file):
+        if not os.path.exists(policy_file):
+            # QMDP solves in no time, so there is always a policy to start with
+            log.warning('No policy file {}, falling back to the QMDP policy'.format(policy_file))
+            self.compute_gamma_reward()
+            alphas, _ = self.mdp_alphas()
+            self.alpha_vecs = [AlphaVector(a=a, v=v) for a, v in zip(self.model.actions, alphas)]
+            return
         with open(policy_file) as f:
             data = json.load(f)
             # print(data['alphavec'])
             self.alpha_vecs = []
             for alpha in data['alphavec']:
                 self.alpha_vecs.append(AlphaVector(a=alpha['action'], v=alpha['v']))
-            
-        
+
+
+def point_backup(B, gammas, reward_matrix):
+    """
+    Point-based backup of many belief points at once
+    :param B: (B, S) matrix of beliefs
+    :param gammas: (A, O, G, S) projections of the previous alpha vectors (see PBVI.compute_gammas)
+    :param reward_matrix: (A, S) rewards
+    :return: (B, S) matrix of the new alpha vectors, one per belief, and their action indices
+    """
+    A, O = gammas.shape[:2]
+
+    # cross sum: R(a) plus, for every observation, the projected vector that is best at each belief point
+    gamma_action_belief = np.empty((A, len(B), B.shape[1]))
+    for ai in range(A):
+        gamma_action_belief[ai] = reward_matrix[ai]
+        for oi in range(O):
+            gamma_ao = gammas[ai, oi]
+            gamma_action_belief[ai] += gamma_ao[np.argmax(np.dot(B, gamma_ao.T), axis=1)]
+
+    # best action of every belief point, i.e. one argmax over the (A, B) values
+    best = np.argmax(np.einsum('abs,bs->ab', gamma_action_belief, B), axis=0)
+    return gamma_action_belief[best, np.arange(len(B))], best
+
+
+def attach_shared(specs):
+    """
+    :param specs: name => (shared memory name, shape, dtype) of blocks allocated by another process
+    :return: name => (SharedMemory, array view)
+    """
+    from multiprocessing import shared_memory
+    blocks = {}
+    for key, (name, shape, dtype) in specs.items():
+        shm = shared_memory.SharedMemory(name=name)
+        blocks[key] = (shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf))
+    return blocks
+
+
+def backup_worker(conn, reward_matrix, specs):
+    """
+    Parallel PBVI process: answers every 'backup' request by backing up its slice of the shared belief points
+    against the shared projections, and writes the new alpha vectors and actions in the shared results
+    """
+    blocks = attach_shared(specs)
+    while True:
+        request = conn.recv()
+        if request[0] == 'backup':
+            G, start, end = request[1:]
+            arrays = {key: array for key, (_, array) in blocks.items()}
+            arrays['alphas'][start:end], arrays['actions'][start:end] = point_backup(
+                arrays['beliefs'][start:end], arrays['gammas'][:, :, :G], reward_matrix)
+            conn.send('done')
+        elif request[0] == 'attach':
+            for shm, _ in blocks.values():
+                shm.close()
+            blocks = attach_shared(request[1])
+        else:
+            break
+    for shm, _ in blocks.values():
+        shm.close()
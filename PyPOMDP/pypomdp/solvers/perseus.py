@@ -0,0 +1,44 @@
+import numpy as np
+
+from solvers.pbvi import PBVI
+
+
+class Perseus(PBVI):
+    """
+    Randomised point-based value iteration (Spaan & Vlassis, 2005). A stage backs up randomly chosen belief points
+    only until the value of every point has improved, as one backup usually improves many points at once.
+    Belief points, pruning, stopping rule and policy file are the ones of PBVI
+    """
+    def add_configs(self, belief_points, warm_start=None, warm_start_lower_bound=None, **kwargs):
+        PBVI.add_configs(self, belief_points, **kwargs)
+        # stages never lower a value, so they must start under V*: a resumed policy is always lowered under it if
+        # needed, whatever warm_start_lower_bound says
+        self.alpha_vecs = [self.lower_bound_alpha()]
+        if warm_start is not None:
+            self.resume_policy(warm_start, lower_bound=True)
+
+    def improve(self, alphas, actions, values):
+        """
+        One Perseus stage: a point backup is kept when it improves the point it was computed at, otherwise the
+        best previous alpha vector of that point is
+        """
+        B = np.asarray(self.belief_points, dtype=float)
+        gammas = self.compute_gammas(alphas)
+
+        new_alphas, new_actions = [], []
+        new_values = np.full(len(B), -np.inf)
+        todo = np.arange(len(B))
+        while len(todo):
+            bi = todo[np.random.randint(len(todo))]
+            alpha, ai = self.backup(alphas, B[bi:bi + 1], gammas)
+            alpha, ai = alpha[0], ai[0]
+            if np.dot(alpha, B[bi]) < values[bi]:
+                best = np.argmax(np.dot(alphas, B[bi]))
+                alpha, ai = alphas[best], actions[best]
+
+            new_alphas.append(alpha)
+            new_actions.append(ai)
+            new_values = np.maximum(new_values, np.dot(B, alpha))
+            todo = todo[(new_values[todo] < values[todo]) & (todo != bi)]
+
+        return np.array(new_alphas), np.array(new_actions), len(new_alphas)
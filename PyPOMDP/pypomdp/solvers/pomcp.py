@@ -1,35 +1,47 @@
 from solvers import Solver
+from solvers.qmdp import QMDP, FIB
 from util.helper import rand_choice, randint, round
-from util.helper import elem_distribution, ucb
-from util.belief_tree import BeliefTree
+from util.helper import ucb_scores, rand_argmax, reseed, systematic_resample, cdf_tables, draw_cdf
+from util.belief_tree import BeliefTree, ParticleSet, NONE
 from logger import Logger as log
+import multiprocessing as mp
 import numpy as np
+import threading
 import time
 
 MAX = np.inf
 
 class UtilityFunction():
+    """
+    Every strategy scores all the action children of a belief node at once, from the tree's statistic arrays
+    """
     @staticmethod
     def ucb1(c):
-        def algorithm(action):
-            return action.V + c * ucb(action.parent.N, action.N)
+        def algorithm(tree, node):
+            children = tree.child_slice(node)
+            return tree.V[children] + c * ucb_scores(tree.N[node], tree.N[children])
         return algorithm
     
     @staticmethod
     def mab_bv1(min_cost, c=1.0):
-        def algorithm(action):
-            if action.mean_cost == 0.0:
-                return MAX
-            ucb_value = ucb(action.parent.N, action.N)
-            return action.mean_reward / action.mean_cost + c * ((1. + 1. / min_cost) * ucb_value) / (min_cost - ucb_value)
+        def algorithm(tree, node):
+            children = tree.child_slice(node)
+            mean_cost = tree.mean_cost[children]
+            ucb_value = ucb_scores(tree.N[node], tree.N[children])
+            with np.errstate(divide='ignore', invalid='ignore'):
+                scores = tree.mean_reward[children] / mean_cost + \
+                         c * ((1. + 1. / min_cost) * ucb_value) / (min_cost - ucb_value)
+            scores[mean_cost == 0.0] = MAX
+            return scores
         return algorithm
 
     @staticmethod
     def sa_ucb(c0):
-        def algorithm(action):
-            if action.mean_cost == 0.0:
-                return MAX
-            return action.V + c0 * action.parent.budget * ucb(action.parent.N, action.N)
+        def algorithm(tree, node):
+            children = tree.child_slice(node)
+            scores = tree.V[children] + c0 * tree.budget[node] * ucb_scores(tree.N[node], tree.N[children])
+            scores[tree.mean_cost[children] == 0.0] = MAX
+            return scores
         return algorithm
 
 
@@ -39,12 +51,45 @@ class POMCP(Solver):
         self.tree = None
 
         self.simulation_time = None  # in seconds
+        self.num_simulations = None  # simulations per step
+        self.timings = None          # seconds spent in each phase of the last solve
         self.max_particles = None    # maximum number of particles can be supplied by hand for a belief node
         self.reinvigorated_particles_ratio = None  # ratio of max_particles to mutate 
         self.utility_fn = None
+        self.workers = []            # pipes to the root-parallel search processes
+        self.leaf_batch = None       # leaves collected before their rollouts run as one vectorised pass
+        self.belief_update = None    # how the particles of a new root are drawn: 'weighted' or 'rejection'
+        self.max_nodes = None        # node budget of the belief tree
+        self.evicted = 0             # nodes evicted during the last search
+        self.ponder = False          # whether to keep searching while the chosen action executes
+        self.pondering = None        # (thread, stop event) of the background search
+        self.pondered = 0            # simulations run by the last pondering
+        self.leaf_values = None      # state values replacing the random rollouts (QMDP or FIB bound)
+        self.root_values = None      # values of the root's action children merged with the workers', for get_action
+        self.legal_cdf = None        # (S, A) cdf of a uniform legal action per state, None when every action is legal
 
     def add_configs(self, budget=float('inf'), initial_belief=None, simulation_time=0.5,
-                    max_particles=350, reinvigorated_particles_ratio=0.1, utility_fn='ucb1', C=0.5):
+                    max_particles=350, reinvigorated_particles_ratio=0.1, utility_fn='ucb1', C=0.5,
+                    num_simulations=None, num_workers=1, leaf_batch=1, belief_update='weighted', max_nodes=None,
+                    ponder=False, leaf_heuristic=None):
+        """
+        :param simulation_time: seconds of search per step, None for no time limit
+        :param num_simulations: simulations per step, None for no count limit. With both limits set the search stops
+            at whichever comes first; a count alone makes every step do the same amount of work whatever the machine
+        :param num_workers: number of processes searching in parallel, this one included (root parallelisation)
+        :param leaf_batch: number of simulations whose rollouts run together (leaf parallelisation), 1 to roll out
+            every simulation on its own
+        :param belief_update: 'weighted' fills the new root's particles with a weighted particle filter step,
+            'rejection' keeps the simulated particles whose observation matches the real one
+        :param max_nodes: node budget of the belief tree, whose least-visited leaves are evicted once it is reached;
+            None for an unbounded tree
+        :param ponder: keep searching in the background between get_action and update_belief (see start_pondering)
+        :param leaf_heuristic: 'qmdp' or 'fib' to value new leaves with max_a alpha_a(s) of that bound instead of a
+            random rollout; None to roll out
+        """
+        if simulation_time is None and num_simulations is None:
+            raise ValueError('Must specify simulation_time, num_simulations or both')
+
         # acquaire utility function to choose the most desirable action to try
         if utility_fn == 'ucb1':
             self.utility_fn = UtilityFunction.ucb1(C)
@@ -57,153 +102,466 @@ class POMCP(Solver):
 
         # other configs
         self.simulation_time = simulation_time
+        self.num_simulations = num_simulations
+        self.leaf_batch = leaf_batch
+        self.belief_update = belief_update
+        self.max_nodes = max_nodes
+        self.ponder = ponder
         self.max_particles = max_particles
         self.reinvigorated_particles_ratio = reinvigorated_particles_ratio
+        self.leaf_values = None
+        if leaf_heuristic is not None:
+            bound = {'qmdp': QMDP, 'fib': FIB}[leaf_heuristic](self.model)
+            bound.add_configs()
+            self.leaf_values = bound.compute_alphas(1000)[0].max(axis=0)
+
+        # legal actions of every state, for the vectorised rollouts
+        m = self.model
+        legal = np.zeros((m.num_states, m.num_actions))
+        for si, state in enumerate(m.states):
+            legal[si, [m.action_ids[a] for a in m.get_legal_actions(state)]] = 1.0
+        self.legal_cdf = None if legal.all() else cdf_tables(legal)
         
         # initialise belief search tree
         root_particles = self.model.gen_particles(n=self.max_particles, prob=initial_belief)
-        self.tree = BeliefTree(budget, root_particles)
+        self.tree = BeliefTree(budget, root_particles, self.max_particles, max_nodes=max_nodes,
+                               action_names=self.model.actions, observation_names=self.model.observations)
+
+        # start the root-parallel workers, all searching from this root's particles
+        self.close()
+        configs = dict(budget=budget, simulation_time=simulation_time, max_particles=max_particles,
+                       reinvigorated_particles_ratio=reinvigorated_particles_ratio, utility_fn=utility_fn, C=C,
+                       num_simulations=num_simulations, leaf_batch=leaf_batch, belief_update=belief_update,
+                       max_nodes=max_nodes, leaf_heuristic=leaf_heuristic)
+        for _ in range(num_workers - 1):
+            conn, worker_conn = mp.Pipe()
+            mp.Process(target=root_search_worker, args=(worker_conn, self.model, configs), daemon=True).start()
+            self.workers.append(conn)
+        self.__sync_workers(NONE, NONE)
+
+    def close(self):
+        """
+        Stops the pondering and the root-parallel workers
+        """
+        self.stop_pondering()
+        for conn in self.workers:
+            try:
+                conn.send(('close',))
+                conn.close()
+            except (OSError, EOFError):
+                # the worker is already gone
+                pass
+        self.workers = []
+
+    def __del__(self):
+        # last resort for solvers dropped without close(), so their workers do not block on recv forever
+        if getattr(self, 'workers', None):
+            self.close()
+
+    def __sync_workers(self, ai, oi):
+        """
+        Advances every worker's tree along (ai, oi) and hands it this root's particles and a fresh seed
+        """
+        tree = self.tree
+        particles, budget = list(tree.particles[tree.root]), tree.budget[tree.root]
+        for conn in self.workers:
+            conn.send(('advance', ai, oi, particles, budget, np.random.randint(2 ** 31)))
+
+    def advance(self, ai, oi, particles, budget):
+        """
+        Moves the root to the belief node reached by action ai and observation oi, keeping the subtree searched
+        under it, and makes 'particles' its particle set
+        """
+        tree = self.tree
+        if ai != NONE:
+            if not tree.num_children[tree.root]:
+                # the root's whole legal-action block, as simulate adds it, so that its children stay consecutive
+                self.expand(tree.root, tree.sample_state(tree.root), tree.budget[tree.root])
+            action_node = tree.get_child(tree.root, ai)
+            if action_node == NONE:
+                # an action this tree never expanded: nothing of it is worth keeping
+                tree = self.tree = BeliefTree(budget, particles, self.max_particles, max_nodes=self.max_nodes,
+                                              action_names=self.model.actions,
+                                              observation_names=self.model.observations)
+            else:
+                new_root = tree.get_child(action_node, oi)
+                if new_root == NONE:
+                    new_root = tree.add(parent=action_node, label=oi)
+                tree.reroot(new_root)
+
+        tree.particles[tree.root] = ParticleSet(self.max_particles, particles)
+        tree.budget[tree.root] = budget
+
+    def root_statistics(self):
+        """
+        :return: action ids, visit counts and values of the root's action children
+        """
+        tree = self.tree
+        children = tree.child_slice(tree.root)
+        return tree.label[children], tree.N[children], tree.V[children]
+
+    def __merge(self, statistics):
+        """
+        Merges the root statistics of the workers with this tree's into self.root_values: visit counts add up and
+        values are averaged weighted by visits. The workers keep their subtrees, so their statistics are running
+        totals; the tree itself is left alone so that they are never counted twice and UCB keeps its own counts
+        """
+        tree = self.tree
+        children = tree.child_slice(tree.root)
+        position = {a: i for i, a in enumerate(tree.label[children])}
+        N = tree.N[children].astype(float)
+        total = N * tree.V[children]
+        for labels, worker_N, worker_V in statistics:
+            for a, n, v in zip(labels, worker_N, worker_V):
+                if a in position:
+                    N[position[a]] += n
+                    total[position[a]] += n * v
+        self.root_values = np.where(N > 0, total / np.maximum(N, 1), tree.V[children])
 
     def compute_belief(self):
         base = [0.0] * self.model.num_states
-        particle_dist = elem_distribution(self.tree.root.B)
+        particle_dist = self.tree.particles[self.tree.root].distribution()
         for state, prob in particle_dist.items():
-            base[self.model.states.index(state)] = round(prob, 6)
+            base[self.model.state_ids[state]] = round(prob, 6)
         return base
 
-    def rollout(self, state, h, depth, max_depth, budget):
+    def rollout(self, state, depth, max_depth, budget):
         """
-        Perform randomized recursive rollout search starting from 'h' util the max depth has been achived
+        Perform randomized rollout starting from 'state' util the max depth has been achived or the budget runs out
         :param state: starting state's index
-        :param h: history sequence
         :param depth: current planning horizon
         :param max_depth: max planning horizon
-        :return:
+        :return: discounted return of the rollout
         """
-        if depth > max_depth or budget <= 0:
-            return 0
+        m, begin = self.model, time.time()
+        if self.leaf_values is not None:
+            return self.leaf_values[m.state_ids[state]]
 
-        ai = rand_choice(self.model.get_legal_actions(state))
-        sj, oj, r, cost = self.model.simulate_action(state, ai)
+        R, discount = 0.0, 1.0
+        while depth <= max_depth and budget > 0:
+            ai = rand_choice(m.get_legal_actions(state))
+            state, oj, r, cost = m.simulate_action(state, ai)
 
-        return r + self.model.discount * self.rollout(sj, h + [ai, oj], depth + 1, max_depth, budget-cost)
-        
-    def simulate(self, state, max_depth, depth=0, h=[], parent=None, budget=None):
+            R += discount * r
+            discount *= m.discount
+            depth += 1
+            budget -= cost
+
+        self.timings['rollout'] += time.time() - begin
+        return R
+
+    def rollout_batch(self, states, depths, max_depth, budgets):
+        """
+        Randomized rollouts from many states at once, with one model.simulate_batch call per depth. Actions are drawn
+        uniformly from the legal actions of every state, as in rollout
+        :param states: starting states' ids
+        :param depths: current planning horizon of every rollout
+        :param max_depth: max planning horizon
+        :param budgets: remaining budget of every rollout
+        :return: discounted returns of the rollouts
+        """
+        m, begin = self.model, time.time()
+        if self.leaf_values is not None:
+            return self.leaf_values[np.asarray(states, dtype=int)]
+
+        states, depths = np.array(states, dtype=int), np.array(depths, dtype=int)
+        budgets = np.array(budgets, dtype=float)
+        R, discount = np.zeros(len(states)), np.ones(len(states))
+
+        alive = np.flatnonzero((depths <= max_depth) & (budgets > 0))
+        while len(alive):
+            if self.legal_cdf is None:
+                actions = np.random.randint(0, len(m.actions), len(alive))
+            else:
+                actions = draw_cdf(self.legal_cdf[states[alive]])
+            states[alive], oj, r, cost = m.simulate_batch(states[alive], actions)
+
+            R[alive] += discount[alive] * r
+            discount[alive] *= m.discount
+            depths[alive] += 1
+            budgets[alive] -= cost
+            alive = alive[(depths[alive] <= max_depth) & (budgets[alive] > 0)]
+
+        self.timings['rollout'] += time.time() - begin
+        return R
+
+    def expand(self, node_h, state, budget):
+        """
+        Adds the affordable legal actions of 'state' as the children of belief node 'node_h'
+        """
+        m = self.model
+        actions, costs = [], []
+        for ai in m.get_legal_actions(state):
+            cost = m.cost_function(ai)
+            # only adds affordable actions
+            if budget - cost >= 0:
+                actions.append(m.action_ids[ai])
+                costs.append(cost)
+        self.tree.add_actions(node_h, actions, costs)
+
+    def simulate(self, state, max_depth, depth=0, parent=NONE, obs=NONE, budget=None):
         """
         Perform MCTS simulation on a POMCP belief search tree
         :param state: starting state's index
+        :param parent: action node the simulation descends from (the root is used when NONE)
+        :param obs: id of the observation received under 'parent'
         :return:
         """
         # Stop recursion once we are deep enough in our built tree
         if depth > max_depth:
             return 0
 
-        obs_h = None if not h else h[-1]
-        node_h = self.tree.find_or_create(h, name=obs_h or 'root', parent=parent,
-                                          budget=budget, observation=obs_h)
+        m, tree = self.model, self.tree
+        node_h = tree.root if parent == NONE else tree.get_child(parent, obs)
+        if node_h == NONE:
+            node_h = tree.add(parent=parent, label=obs, budget=budget)
 
         # ===== ROLLOUT =====
         # Initialize child nodes and return an approximate reward for this
         # history by rolling out until max depth
-        if not node_h.children:
+        if not tree.num_children[node_h]:
             # always reach this line when node_h was just now created
-            for ai in self.model.get_legal_actions(state):
-                cost = self.model.cost_function(ai)
-                # only adds affordable actions
-                if budget - cost >= 0:
-                    self.tree.add(h + [ai], name=ai, parent=node_h, action=ai, cost=cost)
-
-            return self.rollout(state, h, depth, max_depth, budget)
+            self.expand(node_h, state, budget)
+            return self.rollout(state, depth, max_depth, budget)
 
         # ===== SELECTION =====
         # Find the action that maximises the utility value
-        np.random.shuffle(node_h.children)
-        node_ha = sorted(node_h.children, key=self.utility_fn, reverse=True)[0]
+        node_ha = tree.first_child[node_h] + rand_argmax(self.utility_fn(tree, node_h))
+        action = m.actions[tree.label[node_ha]]
 
         # ===== SIMULATION =====
         # Perform monte-carlo simulation of the state under the action
-        sj, oj, reward, cost = self.model.simulate_action(state, node_ha.action)
-        R = reward + self.model.discount * self.simulate(sj, max_depth, depth + 1, h=h + [node_ha.action, oj],
-                                                    parent=node_ha, budget=budget-cost)
+        sj, oj, reward, cost = m.simulate_action(state, action)
+        R = reward + m.discount * self.simulate(sj, max_depth, depth + 1, parent=node_ha,
+                                                obs=m.observation_ids[oj], budget=budget-cost)
         # ===== BACK-PROPAGATION =====
         # Update the belief node for h
-        node_h.B += [state]
-        node_h.N += 1
+        tree.add_particle(node_h, state)
+        tree.N[node_h] += 1
 
         # Update the action node for this action
-        node_ha.update_stats(cost, reward)
-        node_ha.N += 1
-        node_ha.V += (R - node_ha.V) / node_ha.N
+        tree.update_stats(node_ha, cost, reward)
+        tree.N[node_ha] += 1
+        tree.V[node_ha] += (R - tree.V[node_ha]) / tree.N[node_ha]
 
         return R
 
+    def descend(self, state, max_depth, budget):
+        """
+        Runs the selection and simulation phases of simulate down to the first leaf, without rolling out.
+        Every node on the way gets its visit and particle right away, as a virtual loss: the exploration bonus
+        of the path drops, so that the other descents of the same batch spread over the tree
+        :param state: starting state's index
+        :return: the path as (action node, reward) pairs, the leaf's state (None when the max depth was reached first),
+            depth and remaining budget
+        """
+        m, tree = self.model, self.tree
+        path, parent, obs = [], NONE, NONE
+        for depth in range(max_depth + 1):
+            node_h = tree.root if parent == NONE else tree.get_child(parent, obs)
+            if node_h == NONE:
+                node_h = tree.add(parent=parent, label=obs, budget=budget)
+
+            if not tree.num_children[node_h]:
+                self.expand(node_h, state, budget)
+                return path, state, depth, budget
+
+            node_ha = tree.first_child[node_h] + rand_argmax(self.utility_fn(tree, node_h))
+            sj, oj, reward, cost = m.simulate_action(state, m.actions[tree.label[node_ha]])
+
+            tree.add_particle(node_h, state)
+            tree.N[node_h] += 1
+            tree.update_stats(node_ha, cost, reward)
+            tree.N[node_ha] += 1
+            path.append((node_ha, reward))
+
+            state, parent, obs, budget = sj, node_ha, m.observation_ids[oj], budget - cost
+        return path, None, max_depth + 1, budget
+
+    def simulate_leaves(self, states, max_depth):
+        """
+        Leaf-parallel version of simulate: descends once from each of 'states', rolls all the leaves out in one
+        vectorised pass and back-propagates the returns
+        """
+        m, tree = self.model, self.tree
+        leaves = [self.descend(state, max_depth, tree.budget[tree.root]) for state in states]
+
+        returns = np.zeros(len(leaves))
+        pending = [i for i, leaf in enumerate(leaves) if leaf[1] is not None]
+        if pending:
+            returns[pending] = self.rollout_batch([m.state_ids[leaves[i][1]] for i in pending],
+                                                  [leaves[i][2] for i in pending], max_depth,
+                                                  [leaves[i][3] for i in pending])
+
+        # the visits were counted during the descents, only the values are left
+        for (path, _, _, _), R in zip(leaves, returns):
+            for node_ha, reward in reversed(path):
+                R = reward + m.discount * R
+                tree.V[node_ha] += (R - tree.V[node_ha]) / tree.N[node_ha]
+
     def solve(self, T):
         """
         Solves for up to T steps
         """
+        for conn in self.workers:
+            conn.send(('search', T))
+        n, duration = self.search(T)
+
+        self.root_values = None
+        if self.workers:
+            results = [conn.recv() for conn in self.workers]
+            self.__merge([statistics for _, statistics in results])
+            n += sum(worker_n for worker_n, _ in results)
+
+        log.info('# Simulation = {} ({} sims/sec)'.format(n, round(n / duration if duration else 0.0, 1)))
+        log.info('Timings (s): sampling = {}, tree = {}, rollout = {}'.format(
+            *[round(self.timings[phase], 4) for phase in ('sampling', 'tree', 'rollout')]))
+        log.info('Tree: {} nodes, {} KB of node arrays, {} particles, {} nodes evicted'.format(
+            len(self.tree), self.tree.nbytes // 1024, self.tree.num_particles, self.evicted))
+
+    def search(self, T):
+        """
+        Runs the simulations of one step on this process' tree
+        :return: number of simulations and their duration
+        """
+        max_time = MAX if self.simulation_time is None else self.simulation_time
+        max_n = MAX if self.num_simulations is None else self.num_simulations
+        self.timings = {'sampling': 0.0, 'tree': 0.0, 'rollout': 0.0}
+        self.evicted = 0
+
         begin = time.time()
-        n = 0
-        while time.time() - begin < self.simulation_time:
-            n += 1
-            state = self.tree.root.sample_state()
-            self.simulate(state, max_depth=T, h=self.tree.root.h, budget=self.tree.root.budget)
-        log.info('# Simulation = {}'.format(n))
+        n, now = 0, begin
+        while n < max_n and now - begin < max_time:
+            k = int(min(self.leaf_batch, max_n - n))
+            n += k
+            states = [self.tree.sample_state(self.tree.root) for _ in range(k)]
+            sampled = time.time()
+            if self.leaf_batch > 1:
+                self.simulate_leaves(states, max_depth=T)
+            else:
+                self.simulate(states[0], max_depth=T, budget=self.tree.budget[self.tree.root])
+            self.evicted += self.tree.evict()
+
+            self.timings['sampling'] += sampled - now
+            now = time.time()
+            self.timings['tree'] += now - sampled
+        duration = now - begin
+
+        # rollouts run inside the tree search
+        self.timings['tree'] -= self.timings['rollout']
+        return n, duration
 
     def get_action(self, belief):
         """
         Choose the action maximises V
         'belief' is just a part of the function signature but not actually required here
         """
-        root = self.tree.root
-        action_vals = [(action.V, action.action) for action in root.children]
-        return max(action_vals)[1]
+        tree = self.tree
+        values = tree.V[tree.child_slice(tree.root)] if self.root_values is None else self.root_values
+        best = tree.first_child[tree.root] + rand_argmax(values)
+        return self.model.actions[tree.label[best]]
+
+    def start_pondering(self, action, T):
+        """
+        Keeps running simulations on a background thread until update_belief is called, while the chosen action
+        executes and its observation comes in. Every simulation starts with 'action', so the work lands in the
+        subtrees update_belief re-roots on. Does nothing unless pondering is enabled
+        """
+        if not self.ponder:
+            return
+        self.stop_pondering()
+        stop = threading.Event()
+        thread = threading.Thread(target=self.__ponder, args=(action, T, stop), daemon=True)
+        self.pondering = (thread, stop)
+        thread.start()
+
+    def stop_pondering(self):
+        if self.pondering is None:
+            return
+        thread, stop = self.pondering
+        stop.set()
+        thread.join()
+        self.pondering = None
+        log.info('# Pondering simulations = {}'.format(self.pondered))
+
+    def __ponder(self, action, T, stop):
+        m, tree = self.model, self.tree
+        ai = m.action_ids[action]
+        node_ha = tree.get_child(tree.root, ai)
+        self.pondered = 0
+        while not stop.is_set() and node_ha != NONE:
+            state = tree.sample_state(tree.root)
+            sj, oj, reward, cost = m.simulate_action(state, action)
+            self.simulate(sj, max_depth=T, depth=1, parent=node_ha, obs=m.observation_ids[oj],
+                          budget=tree.budget[tree.root] - cost)
+            self.pondered += 1
+            if tree.evict():
+                node_ha = tree.get_child(tree.root, ai)
 
     def update_belief(self, belief, action, obs):
         """
         Updates the belief tree given the environment feedback.
         extending the history, updating particle sets, etc
         """
-        m, root = self.model, self.tree.root
+        self.stop_pondering()
+        m, tree = self.model, self.tree
+        root, ai, oi = tree.root, m.action_ids[action], m.observation_ids[obs]
+        self.root_values = None
 
         #####################
         # Find the new root #
         #####################
-        new_root = root.get_child(action).get_child(obs)
-        if new_root is None:
-            log.warning("Warning: {} is not in the search tree".format(root.h + [action, obs]))
+        action_node = tree.get_child(root, ai)
+        if action_node == NONE and not tree.num_children[root]:
+            # the root's whole legal-action block, as simulate adds it
+            self.expand(root, tree.sample_state(root), tree.budget[root])
+            action_node = tree.get_child(root, ai)
+        if action_node == NONE:
+            # an action the search never tried at the root (e.g. an expert's action in a replay, illegal or
+            # unaffordable in the tree): the root's block cannot take one more child, so a new tree starts at the root
+            log.warning('Warning: {} is not in the search tree, restarting it from the root'.format(action))
+            tree = self.tree = BeliefTree(tree.budget[root], list(tree.particles[root]), self.max_particles,
+                                          max_nodes=self.max_nodes, action_names=m.actions,
+                                          observation_names=m.observations)
+            root = tree.root
+            action_node = tree.add_actions(root, [ai], [m.cost_function(action)])[0]
+            # left empty, so that the particle filter below fills it from the root's particles
+            tree.add(parent=action_node, label=oi, budget=tree.budget[root] - tree.cost[action_node])
+        new_root = tree.get_child(action_node, oi)
+        if new_root == NONE:
+            log.warning("Warning: {} is not in the search tree".format([action, obs]))
             # The step result randomly produced a different observation
-            action_node = root.get_child(action)
-            if action_node.children:
+            if tree.num_children[action_node]:
                 # grab any of the beliefs extending from the belief node's action node (i.e, the nearest belief node)
                 log.info('grabing a bearest belief node...')
-                new_root = rand_choice(action_node.children)
+                new_root = rand_choice(tree.children(action_node))
             else:
                 # or create the new belief node and rollout from there
                 log.info('creating a new belief node')
                 particles = self.model.gen_particles(n=self.max_particles)
-                new_root = self.tree.add(h=action_node.h + [obs], name=obs, parent=action_node, observation=obs,
-                                         particle=particles, budget=root.budget - action_node.cost)
+                new_root = tree.add(parent=action_node, label=oi, particle=particles,
+                                    budget=tree.budget[root] - tree.cost[action_node])
         
         ##################
         # Fill Particles #
         ##################
-        particle_slots = self.max_particles - len(new_root.B)
-        if particle_slots > 0:
-            # fill particles by Monte-Carlo using reject sampling
+        particle_slots = self.max_particles - len(tree.particles[new_root])
+        if particle_slots > 0 and self.belief_update == 'rejection':
+            # fill particles by Monte-Carlo using reject sampling, one batch of root particles at a time
             particles = []
             while len(particles) < particle_slots:
-                si = root.sample_state()
-                sj, oj, r, cost = self.model.simulate_action(si, action)
-
-                if oj == obs:
-                    particles.append(sj)
-            new_root.B += particles
+                si = [m.state_ids[tree.sample_state(root)] for _ in range(particle_slots)]
+                sj, oj, r, cost = m.simulate_batch(si, ai)
+                particles += [m.states[s] for s in sj[oj == oi]]
+            tree.add_particle(new_root, particles[:particle_slots])
+        elif particle_slots > 0:
+            tree.add_particle(new_root, self.weighted_particles(root, ai, oi, particle_slots))
 
         #####################
         # Advance and Prune #
         #####################
-        self.tree.prune(root, exclude=new_root)
-        self.tree.root = new_root
+        new_label = tree.label[new_root]
+        new_root = tree.reroot(new_root)
         new_belief = self.compute_belief()
 
         ###########################
@@ -212,16 +570,55 @@ class POMCP(Solver):
         if any([prob == 0.0 for prob in new_belief]):
             # perform particle re-invigoration when particle deprivation happens
             mutations = self.model.gen_particles(n=int(self.max_particles * self.reinvigorated_particles_ratio))
+            B = tree.particles[new_root]
             for particle in mutations:
-                new_root.B[randint(0, len(new_root.B))] = particle
+                B[randint(0, len(B))] = particle
 
             # re-compute the current belief distribution after reinvigoration
             new_belief =  self.compute_belief()
             log.info(('*** {} random particles are added ***'.format(len(mutations))))
+
+        self.__sync_workers(ai, new_label)
         return new_belief
 
+    def weighted_particles(self, node, ai, oi, n):
+        """
+        One step of an importance-weighted particle filter: the particles of 'node' are propagated through action
+        ai in a single batch, weighted by the probability of observation oi and n of them are drawn by systematic
+        resampling, so the cost is bounded whatever the observation
+        """
+        m = self.model
+        si = [m.state_ids[s] for s in self.tree.particles[node]]
+        sj, _, _, _ = m.simulate_batch(si, ai)
+        weights = m.observation_weights(ai, sj, oi)
+        if not weights.sum():
+            # none of the particles explains the observation: keep them unweighted, reinvigoration follows
+            log.warning('Warning: no particle can emit observation {}'.format(m.observations[oi]))
+            weights = np.ones(len(sj))
+        return [m.states[s] for s in sj[systematic_resample(weights, n)]]
+
     def draw(self, beliefs):
         """
         Dummy
         """
         pass
+
+
+def root_search_worker(conn, model, configs):
+    """
+    Root-parallel search process: keeps its own belief tree, follows the main process' root through 'advance'
+    requests and answers every 'search' request with its simulation count and root statistics
+    """
+    solver = POMCP(model)
+    solver.add_configs(**configs)
+    while True:
+        request = conn.recv()
+        if request[0] == 'search':
+            n, _ = solver.search(request[1])
+            conn.send((n, solver.root_statistics()))
+        elif request[0] == 'advance':
+            ai, oi, particles, budget, seed = request[1:]
+            reseed(seed)
+            solver.advance(ai, oi, particles, budget)
+        else:
+            break
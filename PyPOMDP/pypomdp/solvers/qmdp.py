@@ -0,0 +1,42 @@
+from solvers.pbvi import PBVI
+from util.alpha_vector import AlphaVector
+
+
+class QMDP(PBVI):
+    """
+    QMDP (Littman et al., 1995): one alpha vector per action, the Q-values of the fully observable MDP. It solves in
+    a few vectorised value iterations and upper-bounds the optimal value function, as it assumes the state is known
+    from the next step on. The policy file and get_action are the ones of PBVI
+    """
+    def add_configs(self, epsilon=1e-6):
+        """
+        :param epsilon: value iteration stops once no Q-value changes by epsilon or more
+        """
+        PBVI.add_configs(self, [], epsilon=epsilon)
+
+    def compute_alphas(self, T):
+        """
+        :param T: max number of value iterations
+        :return: (A, S) alpha vectors and the trace of the iterations
+        """
+        return self.mdp_alphas(T, self.epsilon)
+
+    def solve(self, T):
+        if self.solved:
+            return
+
+        m = self.model
+        alphas, self.trace = self.compute_alphas(T)
+        self.converged = self.trace[-1]['residual'] < self.epsilon
+        self.alpha_vecs = [AlphaVector(a=a, v=v) for a, v in zip(m.actions, alphas)]
+        self.solved = True
+        self.saving_policy()
+
+
+class FIB(QMDP):
+    """
+    Fast informed bound (Hauskrecht, 2000): like QMDP, but the observation of every step is known before the next
+    action is picked, which gives a tighter upper bound for a few more operations per iteration
+    """
+    def compute_alphas(self, T):
+        return self.fib_alphas(T, self.epsilon)
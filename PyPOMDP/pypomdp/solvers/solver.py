@@ -38,6 +38,17 @@ class Solver(object):
         :return:
         """
 
+    def close(self):
+        """
+        Releases the processes and resources held by the solver; solvers without any keep this no-op
+        """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
     def take_action(self, action):
         """
         Just a shallow Facade to expose model's take_action method to the external runner
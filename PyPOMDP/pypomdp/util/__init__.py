@@ -2,7 +2,8 @@
 from .helper import *
 from .alpha_vector import AlphaVector
 from .json_encoder import toJSON, NumpyEncoder
-from .belief_tree import Node, BeliefTree, BeliefNode, ActionNode
+from .belief_tree import BeliefTree, ParticleSet
+from .belief_set import BeliefSet
 from .runner_params import RunnerParams
 from .replay_params import ReplayParams
 
@@ -1,3 +1,6 @@
+import numpy as np
+
+
 class AlphaVector(object):
     """
     Simple wrapper for the alpha vector used for representing the value function for a POMDP as a piecewise-linear,
@@ -16,4 +19,62 @@ class AlphaVector(object):
         print(self.__dict__)
 
 
+def prune(alphas, lp=False, tol=1e-9):
+    """
+    Selects the alpha vectors worth keeping, without changing max_k alpha_k . b at any belief b: exact duplicates go
+    first, then the vectors pointwise dominated by another one and, with 'lp', the vectors that are not strictly
+    better than all the others at any belief of the simplex
+
+    :param alphas: (G, S) matrix, one alpha vector per row
+    :param lp: run the linear programs (one per vector, needs scipy)
+    :param tol: margin under which an LP witness does not count
+    :return: sorted row indices of the kept vectors
+    """
+    alphas = np.asarray(alphas, dtype=float)
+    # first occurrence of every distinct row: equal rows are adjacent in lexicographic order, which is stable
+    order = np.lexsort(alphas.T[::-1])
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = np.any(alphas[order[1:]] != alphas[order[:-1]], axis=1)
+    keep = np.sort(order[first])
+
+    # after deduplication, alpha_i <= alpha_j on every state means alpha_j is strictly better somewhere
+    kept = alphas[keep]
+    dominated = np.zeros(len(kept), dtype=bool)
+    chunk = max(1, 2 ** 22 // max(kept.size, 1))    # rows compared at once, about 4M booleans
+    for start in range(0, len(kept), chunk):
+        rows = np.arange(start, min(start + chunk, len(kept)))
+        below = np.all(kept[rows, None, :] <= kept[None], axis=2)
+        below[np.arange(len(rows)), rows] = False
+        dominated[rows] = below.any(axis=1)
+    keep = keep[~dominated]
+
+    if lp and len(keep) > 1:
+        keep = keep[_lp_filter(alphas[keep], tol)]
+    return keep
+
+
+def _lp_filter(alphas, tol):
+    """
+    For every vector, maximises the margin d by which it beats the other kept vectors at some belief b:
+        max d  s.t.  (alpha_i - alpha_k) . b >= d for every k, sum(b) = 1, b >= 0
+    and drops it when d <= tol. Vectors are dropped one by one, so the others are only compared with the survivors
+    :return: boolean mask of the kept vectors
+    """
+    from scipy.optimize import linprog
 
+    G, S = alphas.shape
+    keep = np.ones(G, dtype=bool)
+    c = np.zeros(S + 1)
+    c[-1] = -1.0
+    A_eq = np.append(np.ones(S), 0.0)[None, :]
+    bounds = [(0.0, None)] * S + [(None, None)]
+    for i in range(G):
+        others = alphas[keep & (np.arange(G) != i)]
+        if not len(others):
+            break
+        # d - (alpha_i - alpha_k) . b <= 0
+        A_ub = np.hstack([others - alphas[i], np.ones((len(others), 1))])
+        res = linprog(c, A_ub=A_ub, b_ub=np.zeros(len(others)), A_eq=A_eq, b_eq=[1.0], bounds=bounds)
+        if res.status == 0 and -res.fun <= tol:
+            keep[i] = False
+    return keep
@@ -0,0 +1,83 @@
+import numpy as np
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    # nearest neighbours fall back to brute-force distances
+    cKDTree = None
+
+
+class BeliefSet(object):
+    """
+    Growing set of belief points. A new belief is dropped when its quantised key (probabilities rounded to
+    'resolution') is already in the set, or when it lies closer than 'min_distance' (L1) to a point of the set.
+    Nearest-neighbour distances come from a KD-tree over the points (scipy), rebuilt whenever the points added since
+    the last build outnumber the indexed ones; the recent points are compared by brute force
+    """
+    def __init__(self, num_states, min_distance=0.0, resolution=1e-9, capacity=1024):
+        self.min_distance = min_distance
+        self.resolution = resolution
+        self.points = np.empty((capacity, num_states))
+        self.size = 0
+        self.keys = set()
+        self.tree = None
+        self.indexed = 0    # points covered by the tree
+
+    def __len__(self):
+        return self.size
+
+    def __key(self, belief):
+        return np.round(belief / self.resolution).astype(np.int64).tobytes()
+
+    def __reindex(self):
+        if cKDTree is not None and self.size - self.indexed > max(self.indexed, 64):
+            self.tree = cKDTree(self.points[:self.size])
+            self.indexed = self.size
+
+    def distances(self, beliefs):
+        """
+        :param beliefs: (K, S) matrix
+        :return: L1 distance from every belief to its nearest point of the set (inf when the set is empty)
+        """
+        beliefs = np.atleast_2d(beliefs)
+        nearest = np.full(len(beliefs), np.inf)
+        if self.tree is not None:
+            nearest = self.tree.query(beliefs, p=1)[0]
+        for start in range(self.indexed, self.size, 1024):
+            recent = self.points[start:min(start + 1024, self.size)]
+            nearest = np.minimum(nearest, np.abs(beliefs[:, None, :] - recent[None]).sum(axis=2).min(axis=1))
+        return nearest
+
+    def add(self, beliefs):
+        """
+        Adds the beliefs that are valid, new and far enough from the set and from each other
+        :param beliefs: (K, S) matrix
+        :return: boolean mask of the beliefs added
+        """
+        beliefs = np.atleast_2d(np.asarray(beliefs, dtype=float))
+        added = np.zeros(len(beliefs), dtype=bool)
+        candidates = np.all(np.isfinite(beliefs), axis=1)
+        if self.min_distance > 0 and self.size:
+            candidates &= self.distances(beliefs) >= self.min_distance
+
+        for i in np.flatnonzero(candidates):
+            key = self.__key(beliefs[i])
+            if key in self.keys:
+                continue
+            if self.min_distance > 0 and np.any(np.abs(beliefs[added] - beliefs[i]).sum(axis=1) < self.min_distance):
+                continue
+            self.keys.add(key)
+            added[i] = True
+
+        new = beliefs[added]
+        if self.size + len(new) > len(self.points):
+            grown = np.empty((max(2 * len(self.points), self.size + len(new)), self.points.shape[1]))
+            grown[:self.size] = self.points[:self.size]
+            self.points = grown
+        self.points[self.size:self.size + len(new)] = new
+        self.size += len(new)
+        self.__reindex()
+        return added
+
+    def tolist(self):
+        return self.points[:self.size].tolist()
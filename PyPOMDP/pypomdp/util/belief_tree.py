@@ -1,178 +1,342 @@
+from util.helper import round
+from collections import Counter
+import numpy as np
+import random
 
-from util.helper import rand_choice, round
-from abc import abstractmethod
+NONE = -1
 
-class Node(object):
-    def __init__(self, nid, name, h, parent=None, V=0, N=0):
-        self.h = h
-        self.V = V
-        self.N = N
-        self.id = nid
-        self.name = name
-        self.parent = parent
-        self.children = []
 
-    @abstractmethod
-    def add_child(self, node):
-        """
-         To be implemented.
-        """
-
-    @abstractmethod
-    def get_child(self, *args):
-        """
-         To be implemented.
-        """
-
-class BeliefNode(Node):
+class ParticleSet(object):
     """
-    Represents a node that holds the belief distribution given its history sequence in a belief tree.
-    It also holds the received observation after which the belief is updated accordingly
+    Fixed-capacity particle set of a belief node. Once full, every new particle replaces a random one with the
+    probability of reservoir sampling, so the set stays a uniform sample of everything added to it. A histogram of
+    the particles is kept up to date, so the belief is read in O(support) instead of counting the particles
     """
-    def __init__(self, nid, name, h, obs_index, parent=None, V=0, N=0, budget=float('inf')):
-        Node.__init__(self, nid, name, h, parent, V, N)
-        self.observation = obs_index
-        self.budget = budget
-        self.B = []
-        self.action_map = {}
-
-    def add_child(self, node):
-        self.children.append(node)
-        self.action_map[node.action] = node
-
-    def get_child(self, action):
-        return self.action_map.get(action, None)
-
-    def sample_state(self):
-        return rand_choice(self.B)
-
-    def add_particle(self, particle):
+    def __init__(self, capacity, particles=None):
+        self.capacity = capacity
+        self.particles = []
+        self.counts = Counter()
+        self.seen = 0
+        if particles is not None:
+            self.add(particles)
+
+    def __len__(self):
+        return len(self.particles)
+
+    def __iter__(self):
+        return iter(self.particles)
+
+    def __getitem__(self, i):
+        return self.particles[i]
+
+    def __setitem__(self, i, particle):
+        self.__discard(self.particles[i])
+        self.particles[i] = particle
+        self.counts[particle] += 1
+
+    def __discard(self, particle):
+        self.counts[particle] -= 1
+        if not self.counts[particle]:
+            del self.counts[particle]
+
+    def add(self, particle):
         if type(particle) is list:
-            self.B.extend(particle)
-        else:
-            self.B.append(particle)
-
-    def __repr__(self):
-        return 'Bid = {}, N = {}'.format(self.id, self.N)
-
-
-class ActionNode(Node):
-    """
-    represents the node associated with an POMDP action
-    """
-    def __init__(self, nid, name, h, action_index, cost, parent=None, V=0, N=0):
-        Node.__init__(self, nid, name, h, parent, V, N)
-        self.mean_reward = 0.0
-        self.mean_cost = 0.0
-        self.cost = cost
-        self.action = action_index
-        self.obs_map = {}
-
-    def update_stats(self, cost, reward):
-        self.mean_cost = (self.mean_cost * self.N + cost) / (self.N + 1)
-        self.mean_reward = (self.mean_reward * self.N + reward) / (self.N + 1)
+            for p in particle:
+                self.add(p)
+            return
 
-    def add_child(self, node):
-        self.children.append(node)
-        self.obs_map[node.observation] = node
+        self.seen += 1
+        if len(self.particles) < self.capacity:
+            self.particles.append(particle)
+            self.counts[particle] += 1
+        else:
+            i = int(random.random() * self.seen)
+            if i < self.capacity:
+                self[i] = particle
 
-    def get_child(self, observation):
-        return self.obs_map.get(observation, None)
+    def sample(self):
+        return self.particles[int(random.random() * len(self.particles))]
 
-    def __repr__(self):
-        return 'Aid = {}, N = {}, V = {}'.format(self.id, self.N, round(self.V, 6))
+    def distribution(self):
+        n = float(len(self.particles))
+        return {k: v / n for k, v in self.counts.items()}
 
 
 class BeliefTree:
     """
-    The belief tree decipted in Silver's POMCP paper.
+    The belief tree decipted in Silver's POMCP paper, stored as a struct of arrays.
+    A node is an integer handle indexing the arrays below; belief nodes and action nodes alternate along every path:
+        N, V: visit count and value estimate
+        mean_reward, mean_cost: running means of the immediate reward and cost (action nodes)
+        parent, first_child, next_sibling: tree links, NONE when missing
+        num_children: number of children
+        label: action id of an action node, observation id of a belief node (NONE at the root)
+        is_action: whether the node is an action node
+        budget: remaining budget (belief nodes)
+        cost: action cost (action nodes)
+
+    Histories are not stored: the history of a node is the sequence of labels from the root down to it.
+    The action children of a belief node are added in one block, so they occupy consecutive handles.
     """
-    def __init__(self, total_budget, root_particles):
+    FIELDS = {
+        'N': (np.int64, 0),
+        'V': (np.float64, 0.0),
+        'mean_reward': (np.float64, 0.0),
+        'mean_cost': (np.float64, 0.0),
+        'parent': (np.int64, NONE),
+        'first_child': (np.int64, NONE),
+        'next_sibling': (np.int64, NONE),
+        'num_children': (np.int64, 0),
+        'label': (np.int64, NONE),
+        'is_action': (np.bool_, False),
+        'budget': (np.float64, 0.0),
+        'cost': (np.float64, 0.0),
+    }
+    # share of max_nodes freed by every eviction
+    EVICT_FRACTION = 0.1
+
+    def __init__(self, total_budget, root_particles, max_particles, action_names=None, observation_names=None,
+                 capacity=1024, max_nodes=None):
         """
         :param root_particles: particles sampled from the prior belief distribution; used as initial root's particle set
+        :param max_particles: capacity of the particle set of every belief node
+        :param max_nodes: node budget enforced by evict, None for an unbounded tree
+        :param action_names: names printed for action labels (defaults to the ids)
+        :param observation_names: names printed for observation labels (defaults to the ids)
+        :param capacity: number of nodes preallocated; the arrays double whenever they are full
         """
-        self.counter = 0
-        self.nodes = {}
-        self.root = self.add(h=[], name='root', particle=root_particles, budget=total_budget)
-
-    def __pretty_print__(self, root, depth):
-        if not root.children:
-            # the leaf
-            return
+        self.max_particles = max_particles
+        self.max_nodes = max_nodes
+        if max_nodes is not None:
+            # room for the nodes a simulation adds past the budget before the next eviction
+            capacity = max_nodes + capacity
+        self.action_names = action_names
+        self.observation_names = observation_names
+        self.size = 0
+        self.capacity = capacity
+        for field, (dtype, fill) in self.FIELDS.items():
+            setattr(self, field, np.full(capacity, fill, dtype=dtype))
+
+        # particle set of every belief node (see ParticleSet)
+        self.particles = {}
+        self.root = self.add(particle=root_particles, budget=total_budget)
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def nbytes(self):
+        """
+        Memory held by the node arrays (particle sets excluded)
+        """
+        return sum(getattr(self, field).nbytes for field in self.FIELDS)
 
-        for node in root.children:
-            print('|  ' * depth + str(node))
-            self.__pretty_print__(node, depth + 1)
+    @property
+    def num_particles(self):
+        return sum(len(p) for p in self.particles.values())
 
-    def add(self, h, name, parent=None, action=None, observation=None,
-            particle=None, budget=None, cost=None):
+    def __reserve(self, n):
+        if self.size + n <= self.capacity:
+            return
+        capacity = max(2 * self.capacity, self.size + n)
+        for field, (dtype, fill) in self.FIELDS.items():
+            arr = np.full(capacity, fill, dtype=dtype)
+            arr[:self.size] = getattr(self, field)[:self.size]
+            setattr(self, field, arr)
+        self.capacity = capacity
+
+    def add(self, parent=NONE, label=NONE, particle=None, budget=None, cost=None, is_action=False):
         """
         Creates and adds a new belief node or action node to the belief search tree
 
-        :param h: history sequence
-        :param parent: either ActionNode or BeliefNode
-        :param action: action name
-        :param observation: observation name
-        :param particle: new node's particle set
-        :param budget: remaining budget of a belief nodde
+        :param parent: parent's handle
+        :param label: action id (action node) or observation id (belief node)
+        :param particle: new belief node's particle set
+        :param budget: remaining budget of a belief node
         :param cost: action cost of an action node
-        :return:
+        :return: the new node's handle
         """
-        history = h[:]
-
-        # instantiate node
-        if action is not None:
-            n = ActionNode(self.counter, name, history, parent=parent, action_index=action, cost=cost)
-        else:
-            n = BeliefNode(self.counter, name, history, parent=parent, obs_index=observation, budget=budget)
-
-        if particle is not None:
-            n.add_particle(particle)
-
-        # add the node to belief tree
-        self.nodes[n.id] = n
-        self.counter += 1
-
-        # register node as parent's child
-        if parent is not None:
-            parent.add_child(n)
+        self.__reserve(1)
+        n = self.size
+        self.size += 1
+
+        self.parent[n], self.label[n], self.is_action[n] = parent, label, is_action
+        self.budget[n] = 0.0 if budget is None else budget
+        self.cost[n] = 0.0 if cost is None else cost
+        if not is_action:
+            self.particles[n] = ParticleSet(self.max_particles, particle)
+
+        # register node as parent's (first) child
+        if parent != NONE:
+            self.next_sibling[n] = self.first_child[parent]
+            self.first_child[parent] = n
+            self.num_children[parent] += 1
         return n
 
+    def add_actions(self, parent, actions, costs):
+        """
+        Adds the action children of a belief node as a block of consecutive handles
+        :param actions: action ids
+        :param costs: their costs
+        :return: the children's handles
+        """
+        k = len(actions)
+        self.__reserve(k)
+        nodes = np.arange(self.size, self.size + k)
+        self.size += k
+
+        self.parent[nodes], self.label[nodes], self.is_action[nodes] = parent, actions, True
+        self.cost[nodes] = costs
+        self.next_sibling[nodes[:-1]] = nodes[1:]
+        if k:
+            self.next_sibling[nodes[-1]] = self.first_child[parent]
+            self.first_child[parent] = nodes[0]
+            self.num_children[parent] += k
+        return nodes
+
+    def children(self, node):
+        if not self.is_action[node]:
+            # the action children of a belief node form one block
+            first = self.first_child[node]
+            return list(range(first, first + self.num_children[node]))
+        out = []
+        child = self.first_child[node]
+        while child != NONE:
+            out.append(child)
+            child = self.next_sibling[child]
+        return out
+
+    def child_slice(self, node):
+        """
+        Slice of the action children of a belief node in the node arrays, e.g. tree.V[tree.child_slice(node)]
+        """
+        first = self.first_child[node]
+        return slice(first, first + self.num_children[node])
+
+    def get_child(self, node, label):
+        if node == NONE:
+            # NONE would index the last slot of the arrays
+            return NONE
+        child = self.first_child[node]
+        while child != NONE and self.label[child] != label:
+            child = self.next_sibling[child]
+        return child
+
     def find_or_create(self, h, **kwargs):
         """
-        Search for the node corrresponds to given history, otherwise create one using given params
+        Search for the node corrresponds to given history (labels from the root), otherwise create one using given params
         """
         curr = self.root
-        h_len, root_history_len = len(h), len(self.root.h)
-
-        for step in range(root_history_len, h_len):
-            curr = curr.get_child(h[step])
-            if curr is None:
-                return self.add(h, **kwargs)
+        for label in h:
+            curr = self.get_child(curr, label)
+            if curr == NONE:
+                return self.add(**kwargs)
         return curr
 
-    def prune(self, node, exclude=None):
+    def update_stats(self, node, cost, reward):
+        N = self.N[node]
+        self.mean_cost[node] = (self.mean_cost[node] * N + cost) / (N + 1)
+        self.mean_reward[node] = (self.mean_reward[node] * N + reward) / (N + 1)
+
+    def sample_state(self, node):
+        return self.particles[node].sample()
+
+    def add_particle(self, node, particle):
+        self.particles[node].add(particle)
+
+    def __compact(self, root, removed=None):
+        """
+        Keeps the subtree of 'root' minus the subtrees of the 'removed' nodes (boolean mask), compacted in
+        breadth-first order: children of a node stay consecutive and after their parent. Handles change and the
+        kept root becomes 0
         """
-        Removes the entire subtree subscribed to 'node' with exceptions.
-        :param node: root of the subtree to be removed
-        :param exclude: exception component
-        :return:
+        order, i = [root], 0
+        while i < len(order):
+            children = self.children(order[i])
+            order.extend(children if removed is None else [c for c in children if not removed[c]])
+            i += 1
+
+        n = len(order)
+        order = np.array(order, dtype=np.int64)
+        remap = np.full(self.size + 1, NONE, dtype=np.int64)  # remap[NONE] stays NONE
+        remap[order] = np.arange(n)
+
+        for field, (dtype, fill) in self.FIELDS.items():
+            arr = getattr(self, field)
+            arr[:n] = arr[order]
+            arr[n:self.size] = fill
+
+        # rebuild the links: the children of a node are a run of consecutive handles
+        parent = remap[self.parent[:n]]
+        parent[0] = NONE
+        self.parent[:n] = parent
+        self.next_sibling[:n] = NONE
+        self.next_sibling[1:n - 1] = np.where(parent[2:] == parent[1:-1], np.arange(2, n), NONE)
+        self.first_child[:n] = NONE
+        starts = np.flatnonzero(parent[1:] != parent[:-1]) + 1
+        self.first_child[parent[starts]] = starts
+        self.num_children[:n] = np.bincount(parent[1:], minlength=n)
+
+        self.particles = {remap[k]: p for k, p in self.particles.items() if remap[k] != NONE}
+        self.size = n
+        self.root = 0
+
+    def reroot(self, node):
         """
-        for child in node.children:
-            if exclude and exclude.id != child.id:
-                self.prune(child, exclude)
+        Makes 'node' the new root and drops everything outside of its subtree
+        :return: the new root's handle (0)
+        """
+        self.__compact(node)
+        return self.root
 
-        self.nodes[node.id] = None
-        del self.nodes[node.id]
+    def evict(self):
+        """
+        Once the tree holds max_nodes nodes, drops the least-visited leaf belief nodes (with their action children)
+        until EVICT_FRACTION of the budget is free again. Must run between simulations, as handles change
+        :return: number of nodes dropped
+        """
+        if self.max_nodes is None or self.size < self.max_nodes:
+            return 0
+
+        size, target = self.size, int(self.max_nodes * (1.0 - self.EVICT_FRACTION))
+        while self.size > target:
+            n = self.size
+            # leaf belief nodes: none of their action children has been expanded yet
+            expanded = np.zeros(n, dtype=bool)
+            busy = np.flatnonzero(self.is_action[:n] & (self.num_children[:n] > 0))
+            expanded[self.parent[busy]] = True
+            leaves = np.flatnonzero(~self.is_action[:n] & ~expanded)
+            leaves = leaves[leaves != self.root]
+            if not len(leaves):
+                break
+
+            leaves = leaves[np.argsort(self.N[leaves], kind='stable')]
+            freed = np.cumsum(1 + self.num_children[leaves])
+            removed = np.zeros(n, dtype=bool)
+            removed[leaves[:np.searchsorted(freed, n - target) + 1]] = True
+            self.__compact(self.root, removed)
+        return size - self.size
+
+    def name(self, node):
+        label = self.label[node]
+        if label == NONE:
+            return 'root'
+        names = self.action_names if self.is_action[node] else self.observation_names
+        return str(label) if names is None else names[label]
+
+    def node_str(self, node):
+        if self.is_action[node]:
+            return 'Aid = {}, N = {}, V = {}'.format(node, self.N[node], round(self.V[node], 6))
+        return 'Bid = {}, N = {}'.format(node, self.N[node])
 
-    def prune_siblings(self, node):
-        siblings = [child for child in node.parent.children if child.id != node.id]
-        for sb in siblings:
-            self.prune(sb)
+    def __pretty_print__(self, root, depth):
+        for node in self.children(root):
+            print('|  ' * depth + self.node_str(node))
+            self.__pretty_print__(node, depth + 1)
 
     def pretty_print(self):
         """
          pretty prints tree's structure
         """
-        print(self.root)
+        print(self.node_str(self.root))
         self.__pretty_print__(self.root, depth=1)
@@ -44,6 +44,85 @@ def draw_arg(probs):
     return np.random.choice(list(range(len(probs))), p=probs/probs.sum())
 
 
+def alias_table(probs):
+    """
+    Builds a Walker alias table (Vose's method) so that the distribution can be sampled in O(1) by draw_alias.
+    An all-zero row is turned into a uniform table
+    :param probs: (unnormalised) probabilities
+    :return: acceptance probabilities and alias indices
+    """
+    n = len(probs)
+    total = float(np.sum(probs))
+    prob, alias = np.ones(n), np.arange(n)
+    if total <= 0.0:
+        return prob, alias
+
+    scaled = [p * n / total for p in probs]
+    small = [i for i, p in enumerate(scaled) if p < 1.0]
+    large = [i for i, p in enumerate(scaled) if p >= 1.0]
+    while small and large:
+        s, l = small.pop(), large.pop()
+        prob[s], alias[s] = scaled[s], l
+        scaled[l] += scaled[s] - 1.0
+        (small if scaled[l] < 1.0 else large).append(l)
+
+    # whatever is left only differs from 1.0 by rounding errors
+    return prob, alias
+
+
+def alias_tables(probs):
+    """
+    Builds one alias table per row of the last axis of 'probs', e.g. for every (action, state) row of T
+    :return: acceptance probabilities and alias indices, both with the shape of 'probs'
+    """
+    probs = np.asarray(probs, dtype=float)
+    rows = probs.reshape(-1, probs.shape[-1])
+    prob, alias = np.ones(rows.shape), np.zeros(rows.shape, dtype=int)
+    for i, row in enumerate(rows):
+        prob[i], alias[i] = alias_table(row.tolist())
+    return prob.reshape(probs.shape), alias.reshape(probs.shape)
+
+
+def draw_alias(prob, alias):
+    """
+    Samples an index from an alias table with two uniform draws
+    """
+    k = int(random.random() * len(prob))
+    return k if random.random() < prob[k] else int(alias[k])
+
+
+def cdf_tables(probs):
+    """
+    Normalised cumulative sums along the last axis of 'probs', ready for draw_cdf. All-zero rows are made uniform,
+    the same way alias_table does
+    """
+    probs = np.array(probs, dtype=float)
+    totals = probs.sum(axis=-1, keepdims=True)
+    probs = np.where(totals > 0.0, probs, 1.0)
+    cdf = np.cumsum(probs, axis=-1)
+    return cdf / cdf[..., -1:]
+
+
+def draw_cdf(cdf):
+    """
+    Per-row inverse-CDF sampling: draws one index for each row of a (n, k) matrix of cumulative probabilities
+    """
+    u = np.random.random_sample((cdf.shape[0], 1))
+    return np.minimum((cdf <= u).sum(axis=1), cdf.shape[1] - 1)
+
+
+def systematic_resample(weights, n):
+    """
+    Systematic resampling: n evenly spaced positions, shifted by a single uniform draw, are looked up in the
+    cumulative weights
+    :param weights: (unnormalised) importance weights
+    :return: indices of the n drawn elements
+    """
+    cdf = np.cumsum(weights)
+    positions = (np.random.random() + np.arange(n)) / n * cdf[-1]
+    return np.minimum(np.searchsorted(cdf, positions, side='right'), len(cdf) - 1)
+
+
 def elem_distribution(arr):
     cnt = Counter(arr)
     _sum = sum(cnt.values())
@@ -64,11 +143,26 @@ def rand(n=1, seed=None):
     return np.random.rand() * n
 
 
-@jit(forceobj=True)
 def rand_choice(candidates):
+    # plain Python: an object-mode jit wrapper costs more than the choice itself
     return random.choice(candidates)
 
 
+@jit(nopython=True)
+def seed_jit(seed):
+    # jitted code draws from numba's own generator, which np.random.seed in Python does not reach
+    np.random.seed(seed)
+
+
+def reseed(seed):
+    """
+    Seeds every random number generator used by the solvers: random, numpy and numba's
+    """
+    random.seed(seed)
+    np.random.seed(seed)
+    seed_jit(seed)
+
+
 @jit(forceobj=True)
 def randint(low, high, seed=None):
     if seed:
@@ -84,3 +178,36 @@ def ucb(N_h, N_ha):
         return MAX
     return np.sqrt(np.log(N_h) / N_ha)  # Upper-Confidence-Bound
 
+
+
+# compiled eagerly so that the first search does not spend its time budget compiling
+@jit('float64[:](int64, int64[:])', nopython=True)
+def ucb_scores(N_h, N_ha):
+    """
+    ucb of every child at once
+    :param N_h: visit count of the parent
+    :param N_ha: visit counts of the children
+    """
+    scores = np.empty(len(N_ha))
+    for i in range(len(N_ha)):
+        scores[i] = ucb(N_h, N_ha[i])
+    return scores
+
+
+@jit('int64(float64[:])', nopython=True)
+def rand_argmax(values):
+    """
+    Index of the largest value, ties broken uniformly at random (NaNs are never picked unless all values are NaN)
+    """
+    best, count, top = -1, 0, -MAX
+    for i in range(len(values)):
+        if values[i] > top:
+            best, count, top = i, 1, values[i]
+        elif values[i] == top:
+            # keeps each of the tied indices with equal probability
+            count += 1
+            if np.random.random() * count < 1.0:
+                best = i
+    if best == -1:
+        best = np.random.randint(0, len(values))
+    return best
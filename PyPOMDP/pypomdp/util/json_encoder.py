@@ -5,6 +5,8 @@ class NumpyEncoder(json.JSONEncoder):
     def default(self, obj):
         if isinstance(obj, np.ndarray):
             return obj.tolist()
+        if isinstance(obj, np.generic):
+            return obj.item()
         return json.JSONEncoder.default(self, obj)
 
 class toJSON():
@@ -24,6 +26,9 @@ class toJSON():
         
     def saving_belief_points(self, beliefs):
         self._data['beliefs'] = beliefs
+
+    def saving_metadata(self, metadata):
+        self._data['metadata'] = metadata
         #for b in beliefs :
         #    self._data['beliefs'].append(b.__dict__)
 
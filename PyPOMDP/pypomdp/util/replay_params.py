@@ -4,7 +4,7 @@ ROOT = os.getcwd()
 
 class ReplayParams:
 	def __init__(self, env, logfile, config, budget, max_play, 
-              snapshot, random_prior, sim, policyfile, option, expfile, classif, fnames):
+              snapshot, random_prior, sim, policyfile, option, backend, expfile, classif, fnames):
 		# given params
 		self.env = env
 		self.budget = budget
@@ -16,6 +16,7 @@ class ReplayParams:
 		self.policyfile = policyfile
 		self.sim = sim
 		self.option = option
+		self.backend = backend
 		self.expfile = expfile
 		self.classif_model = classif
 		self.fnames = fnames
@@ -23,6 +24,8 @@ class ReplayParams:
 		# default params
 		self.config_folder = os.path.join(ROOT, 'configs')
 		self.env_folder = os.path.join(ROOT, 'environments', 'pomdp')
+		self.pomdpx_folder = os.path.join(ROOT, 'environments', 'pomdpx')
+		self.cache_folder = os.path.join(ROOT, 'cache')
 
 	@property
 	def algo_config(self):
@@ -30,4 +33,6 @@ class ReplayParams:
 
 	@property
 	def env_config(self):
+		if self.env.endswith('.pomdpx'):
+			return os.path.join(self.pomdpx_folder, self.env)
 		return os.path.join(self.env_folder, self.env)
@@ -4,7 +4,7 @@ ROOT = os.getcwd()
 
 class RunnerParams:
 	def __init__(self, env, logfile, config, budget, max_play, 
-              snapshot, random_prior, sim, policyfile, option, random_policy):
+              snapshot, random_prior, sim, policyfile, option, backend, random_policy):
 		# given params
 		self.env = env
 		self.budget = budget
@@ -16,11 +16,14 @@ class RunnerParams:
 		self.policyfile = policyfile
 		self.sim = sim
 		self.option = option
+		self.backend = backend
 		self.random_policy = random_policy
         
 		# default params
 		self.config_folder = os.path.join(ROOT, 'configs')
 		self.env_folder = os.path.join(ROOT, 'environments', 'pomdp')
+		self.pomdpx_folder = os.path.join(ROOT, 'environments', 'pomdpx')
+		self.cache_folder = os.path.join(ROOT, 'cache')
 
 	@property
 	def algo_config(self):
@@ -28,4 +31,6 @@ class RunnerParams:
 
 	@property
 	def env_config(self):
+		if self.env.endswith('.pomdpx'):
+			return os.path.join(self.pomdpx_folder, self.env)
 		return os.path.join(self.env_folder, self.env)
@@ -0,0 +1,134 @@
+import numpy as np
+from util.helper import alias_table
+
+
+class CSRMatrix(object):
+    """
+    Minimal compressed-sparse-row matrix holding only nonzero entries. Row r spans data[indptr[r]:indptr[r + 1]]
+    with column ids indices[indptr[r]:indptr[r + 1]], sorted by column.
+    """
+    def __init__(self, indptr, indices, data, shape):
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.data = np.asarray(data, dtype=float)
+        self.shape = tuple(shape)
+        # row id of every stored entry (i.e. the COO rows)
+        self.rows = np.repeat(np.arange(self.shape[0]), np.diff(self.indptr))
+
+    @staticmethod
+    def from_coo(rows, cols, vals, shape):
+        """
+        Builds the matrix from (row, col, value) triplets, dropping zeros. Duplicated cells keep the last value,
+        the same way repeated entries overwrite each other in the parsed dicts
+        """
+        rows, cols = np.asarray(rows, dtype=np.int64), np.asarray(cols, dtype=np.int64)
+        vals = np.asarray(vals, dtype=float)
+
+        # keep the last occurrence of every cell
+        keys = rows * shape[1] + cols
+        _, last = np.unique(keys[::-1], return_index=True)
+        keep = np.sort(len(keys) - 1 - last)
+        rows, cols, vals = rows[keep], cols[keep], vals[keep]
+
+        nonzero = vals != 0.0
+        rows, cols, vals = rows[nonzero], cols[nonzero], vals[nonzero]
+        order = np.lexsort((cols, rows))
+        indptr = np.zeros(shape[0] + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=shape[0]), out=indptr[1:])
+        return CSRMatrix(indptr, cols[order], vals[order], shape)
+
+    @staticmethod
+    def from_dict(probs, row_ids, col_ids):
+        """
+        Builds the matrix from a parsed T or Z dict keyed by (action, state, state-or-observation) names.
+        Row (a, s) is stored at a * len(states) + s. Keys naming unknown elements are ignored, like they are never
+        looked up by the dict-backed Model
+        :param row_ids: ({action: id}, {state: id})
+        :param col_ids: {state-or-observation: id}
+        """
+        action_ids, state_ids = row_ids
+        n_states = len(state_ids)
+        rows, cols, vals = [], [], []
+        for (a, s, c), p in probs.items():
+            if a in action_ids and s in state_ids and c in col_ids:
+                rows.append(action_ids[a] * n_states + state_ids[s])
+                cols.append(col_ids[c])
+                vals.append(p)
+        return CSRMatrix.from_coo(rows, cols, vals, (len(action_ids) * n_states, len(col_ids)))
+
+    def __repr__(self):
+        return 'CSRMatrix(shape = {}, nnz = {})'.format(self.shape, self.nnz)
+
+    @property
+    def nnz(self):
+        return len(self.data)
+
+    def transpose_blocks(self, block_size):
+        """
+        Transposes every block of 'block_size' consecutive rows, e.g. turns Z stored by (a, s') rows into a matrix
+        stored by (a, o) rows whose columns are next states
+        """
+        blocks = self.rows // block_size
+        rows = blocks * self.shape[1] + self.indices
+        cols = self.rows - blocks * block_size
+        return CSRMatrix.from_coo(rows, cols, self.data, ((self.shape[0] // block_size) * self.shape[1], block_size))
+
+    def row(self, r):
+        start, end = self.indptr[r], self.indptr[r + 1]
+        return self.indices[start:end], self.data[start:end]
+
+    def dense_row(self, r):
+        v = np.zeros(self.shape[1])
+        cols, vals = self.row(r)
+        v[cols] = vals
+        return v
+
+    def row_sums(self, weights, first_row, n_rows):
+        """
+        Sums 'weights' (aligned with the stored entries of rows [first_row, first_row + n_rows), optionally with
+        leading batch axes) per row
+        :return: array of shape weights.shape[:-1] + (n_rows,)
+        """
+        indptr = self.indptr[first_row:first_row + n_rows + 1] - self.indptr[first_row]
+        out = np.zeros(weights.shape[:-1] + (n_rows,))
+        nonempty = indptr[:-1] < indptr[1:]
+        if weights.shape[-1]:
+            out[..., nonempty] = np.add.reduceat(weights, indptr[:-1][nonempty], axis=-1)
+        return out
+
+    def alias_tables(self):
+        """
+        One alias table per row over the row's stored entries; aliases are offsets within the row
+        """
+        prob, alias = np.ones(self.nnz), np.zeros(self.nnz, dtype=np.int64)
+        # single-entry (deterministic) rows are already right
+        for r in np.flatnonzero(np.diff(self.indptr) > 1):
+            start, end = self.indptr[r], self.indptr[r + 1]
+            prob[start:end], alias[start:end] = alias_table(self.data[start:end].tolist())
+        return prob, alias
+
+    def cdf_keys(self):
+        """
+        Row id plus the row-normalised cumulative probability of every stored entry. The keys are globally sorted,
+        so inverse-CDF sampling for many rows at once is a single searchsorted (see sample_rows)
+        """
+        cumsum = np.cumsum(self.data)
+        starts = np.repeat(self.indptr[:-1], np.diff(self.indptr))
+        before = np.where(starts > 0, cumsum[np.maximum(starts - 1, 0)], 0.0)
+        totals = self.row_sums(self.data, 0, self.shape[0])[self.rows]
+        return self.rows + np.minimum((cumsum - before) / totals, 1.0)
+
+    def sample_rows(self, keys, rows):
+        """
+        Draws one column per requested row by inverse-CDF sampling. Empty rows draw a uniform column
+        :param keys: output of cdf_keys
+        :param rows: row ids
+        """
+        u = np.random.random_sample(len(rows))
+        pos = np.searchsorted(keys, rows + u, side='right')
+        empty = self.indptr[rows] == self.indptr[rows + 1]
+        pos = np.minimum(pos, self.indptr[rows + 1] - 1)
+        cols = self.indices[np.maximum(pos, 0)]
+        if empty.any():
+            cols[empty] = (u[empty] * self.shape[1]).astype(np.int64)
+        return cols